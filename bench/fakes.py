@@ -0,0 +1,234 @@
+import asyncio
+import itertools
+import time
+from datetime import datetime
+
+import discord
+
+from utils.metrics import timed_query
+
+
+class SendSink:
+    """送信された通知を (送信先, Embed, 受信時刻) として記録します"""
+
+    def __init__(self):
+        self.sent = []
+        self.waiters = {}
+
+    def record(self, route, embeds):
+        now = time.perf_counter()
+        for embed in embeds:
+            self.sent.append((route, embed, now))
+        for future in self.waiters.pop(route, []):
+            if not future.done():
+                future.set_result(now)
+
+    def wait_for(self, route):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(route, []).append(future)
+        return future
+
+
+class FakeChannel:
+    def __init__(self, sink, route, guild=None):
+        self.sink = sink
+        self.route = route
+        self.guild = guild
+
+    async def send(self, content=None, embeds=None, embed=None):
+        self.sink.record(self.route, embeds or [embed])
+
+
+class FakeUser:
+    def __init__(self, sink, user_id):
+        self.id = user_id
+        self.dm_channel = FakeChannel(sink, ('user', user_id))
+
+
+class FakeMember:
+    def __init__(self, guild, member_id, name, bot=True, status=discord.Status.online):
+        self.guild = guild
+        self.id = member_id
+        self.name = name
+        self.bot = bot
+        self.status = status
+        self.mention = f"<@{member_id}>"
+
+    def with_status(self, status):
+        return FakeMember(self.guild, self.id, self.name, self.bot, status)
+
+
+class FakeGuild:
+    def __init__(self, guild_id, shard_id):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.shard_id = shard_id
+        self.chunked = True
+        self._members = {}
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def add_member(self, member):
+        self._members[member.id] = member
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = ''
+
+
+class FakeBot:
+    """HealthCheckGroup が参照する範囲だけを実装した AutoShardedBot の代わり"""
+
+    def __init__(self, sink, shard_count=1):
+        self.sink = sink
+        self.shards = {shard_id: None for shard_id in range(shard_count)}
+        self.latency = 0.05
+        self.intents = discord.Intents.all()
+        self._guilds = {}
+        self._channels = {}
+        self._users = {}
+
+    @property
+    def guilds(self):
+        return list(self._guilds.values())
+
+    def add_guild(self, guild):
+        self._guilds[guild.id] = guild
+
+    def get_guild(self, guild_id):
+        return self._guilds.get(guild_id)
+
+    def add_channel(self, channel_id, guild):
+        self._channels[channel_id] = FakeChannel(self.sink, ('channel', channel_id), guild)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            raise discord.NotFound(FakeResponse(404), 'Unknown Channel')
+        return channel
+
+    def get_user(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = FakeUser(self.sink, user_id)
+        return user
+
+    async def fetch_user(self, user_id):
+        return self.get_user(user_id)
+
+    async def wait_until_ready(self):
+        return None
+
+    def is_closed(self):
+        return False
+
+
+class MemoryBotTable:
+    """BotTable のうち監視処理が使うメソッドをメモリ上の行で置き換えます
+
+    各メソッドは timed_query で計測されるため、実際の BotTable と同じ方法でクエリ数を数えられます。
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.rows = {}
+        self.state = {}
+        self.subscriptions = []
+        self.outbox = {}
+        self.ids = itertools.count(1)
+
+    def seed(self, guild_id, bot_id, user_id, name, channel_id=None, **settings):
+        row = {'id': next(self.ids), 'guild_id': guild_id, 'bot_id': bot_id, 'user_id': user_id, 'name': name,
+               'last_online': datetime.utcnow()}
+        row.update(settings)
+        self.rows[(guild_id, bot_id)] = row
+        # 登録時と同じく登録者のDMへの購読を持たせる
+        self.subscriptions.append({'guild_id': guild_id, 'bot_id': bot_id, 'kind': 'user', 'target': str(user_id)})
+        if channel_id is not None:
+            self.subscriptions.append({'guild_id': guild_id, 'bot_id': bot_id, 'kind': 'channel', 'target': str(channel_id)})
+
+    async def _roundtrip(self):
+        await asyncio.sleep(self.latency)
+
+    @timed_query
+    async def get_monitored_bots(self, guild_ids):
+        await self._roundtrip()
+        guild_ids = set(guild_ids)
+        return [dict(row, **self.state.get(key, {})) for key, row in self.rows.items() if key[0] in guild_ids]
+
+    @timed_query
+    async def save_bot_states(self, online_rows, notification_rows, outbox_rows=()):
+        await self._roundtrip()
+        for key, guild_id, bot_id, event, kind, target, payload in outbox_rows:
+            if (guild_id, bot_id) in self.rows and key not in self.outbox:
+                self.outbox[key] = {'id': next(self.ids), 'idempotency_key': key, 'guild_id': guild_id, 'bot_id': bot_id,
+                                    'event': event, 'kind': kind, 'target': str(target), 'payload': payload,
+                                    'attempts': 0, 'claimed': False, 'sent': False}
+        for guild_id, bot_id, last_online in online_rows:
+            if (guild_id, bot_id) in self.rows:
+                self.rows[(guild_id, bot_id)]['last_online'] = last_online
+        for row in notification_rows:
+            if row[:2] in self.rows:
+                self.state[row[:2]] = dict(zip(('last_notification_time', 'last_dm_notification_time',
+                                                'last_dm_online_notification_time', 'last_channel_notification_time',
+                                                'last_channel_online_notification_time'), row[2:]))
+
+    @timed_query
+    async def claim_notifications(self, worker_id, limit=100, lease_seconds=120, max_attempts=5):
+        await self._roundtrip()
+        rows = [row for row in self.outbox.values() if not row['sent'] and not row['claimed'] and row['attempts'] < max_attempts][:limit]
+        for row in rows:
+            row['claimed'] = True
+            row['attempts'] += 1
+        return [dict(row) for row in rows]
+
+    @timed_query
+    async def finish_notifications(self, sent_ids):
+        await self._roundtrip()
+        sent_ids = set(sent_ids)
+        for row in self.outbox.values():
+            if row['id'] in sent_ids:
+                row['sent'] = True
+
+    @timed_query
+    async def get_subscriptions(self, guild_ids):
+        await self._roundtrip()
+        guild_ids = set(guild_ids)
+        return [row for row in self.subscriptions if row['guild_id'] in guild_ids]
+
+    @timed_query
+    async def get_heartbeats(self, guild_ids):
+        await self._roundtrip()
+        return []
+
+    @timed_query
+    async def get_user_bots(self, user_id, guild_id):
+        await self._roundtrip()
+        return [row for row in self.rows.values() if row['user_id'] == user_id and row['guild_id'] == guild_id]
+
+
+class MemoryHistoryTable:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.events = []
+
+    @timed_query
+    async def insert_status_events(self, events):
+        if not events:
+            return
+        await asyncio.sleep(self.latency)
+        self.events.extend(events)
+
+    @timed_query
+    async def roll_up(self, until, max_hours=24):
+        return until
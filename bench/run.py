@@ -0,0 +1,155 @@
+"""ヘルスチェックのオフラインベンチマーク
+
+Discordやデータベースに接続せず、偽のギルド/メンバーとメモリ上のテーブルで HealthCheckGroup を動かし、
+BOT数ごとの同期処理の所要時間・クエリ数・メモリ使用量・検知遅延を計測します。
+
+    python -m bench.run --bots 1000,10000,50000
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import logging
+import math
+import random
+import time
+import tracemalloc
+
+import discord
+from discord.ext import tasks
+
+from bench.fakes import FakeBot, FakeGuild, FakeMember, MemoryBotTable, MemoryHistoryTable, SendSink
+from utils.metrics import DB_QUERY_SECONDS
+
+health_check = importlib.import_module('cogs.tool.health-chack')
+
+
+def query_count():
+    return sum(sum(child.counts) for child in DB_QUERY_SECONDS._children.values())
+
+
+def build_world(sink, bots, bots_per_guild, shard_count, db_latency):
+    bot = FakeBot(sink, shard_count)
+    table = MemoryBotTable(db_latency)
+    guild_count = math.ceil(bots / bots_per_guild)
+    member_id = 10_000_000
+    for guild_index in range(guild_count):
+        guild = FakeGuild(1_000_000 + guild_index, guild_index % shard_count)
+        bot.add_guild(guild)
+        bot.add_channel(2_000_000 + guild_index, guild)
+        for _ in range(min(bots_per_guild, bots - guild_index * bots_per_guild)):
+            member_id += 1
+            member = FakeMember(guild, member_id, f"bot-{member_id}")
+            guild.add_member(member)
+            # 猶予時間0で登録し、検知から通知までの処理時間だけを測る
+            table.seed(guild.id, member.id, 1, member.name, channel_id=2_000_000 + guild_index, grace_seconds=0)
+    return bot, table
+
+
+def create_cog(bot, table, history):
+    cog = health_check.HealthCheckGroup(bot, None)
+    # ループは手動で駆動する
+    for name in dir(type(cog)):
+        attr = getattr(cog, name, None)
+        if isinstance(attr, tasks.Loop):
+            attr.cancel()
+    cog.db = table
+    cog.states.save = table.save_bot_states
+    cog.history = history
+    cog.leases.owned = set(bot.shards)
+    cog.leases.expires = math.inf
+    cog.leases_ready.set()
+    cog.presence_ready.update(bot.shards)
+    return cog
+
+
+async def measure_detection(cog, bot, sink, samples):
+    members = [member for guild in bot.guilds for member in guild.members]
+    delays = []
+    for member in random.sample(members, min(samples, len(members))):
+        waiter = sink.wait_for(('user', 1))
+        after = member.with_status(discord.Status.offline)
+        member.guild.add_member(after)
+        started = time.perf_counter()
+        await cog.on_presence_update(member, after)
+        try:
+            delays.append(await asyncio.wait_for(waiter, timeout=10) - started)
+        except asyncio.TimeoutError:
+            delays.append(math.inf)
+        member.guild.add_member(member)
+        await cog.on_presence_update(after, member)
+    return delays
+
+
+async def run_case(bots, bots_per_guild, shard_count, db_latency, samples):
+    result = {'bots': bots}
+    async with harness(bots, bots_per_guild, shard_count, db_latency) as (cog, bot, sink):
+        result['guilds'] = len(bot.guilds)
+        for label in ('cold', 'warm'):
+            queries = query_count()
+            started = time.perf_counter()
+            await cog.check_bots()
+            result[f'{label}_sweep_ms'] = (time.perf_counter() - started) * 1000
+            result[f'{label}_queries'] = query_count() - queries
+        delays = sorted(await measure_detection(cog, bot, sink, samples))
+        result['detect_p50_ms'] = delays[len(delays) // 2] * 1000 if delays else None
+        result['detect_max_ms'] = delays[-1] * 1000 if delays else None
+
+    # tracemalloc は処理時間を大きく歪めるため、メモリ使用量は別の実行で計測する
+    tracemalloc.start()
+    try:
+        async with harness(bots, bots_per_guild, shard_count, db_latency, traced=True) as (cog, bot, sink):
+            await cog.check_bots()
+            result['memory_mb'] = (tracemalloc.get_traced_memory()[0] - bot.baseline) / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+@contextlib.asynccontextmanager
+async def harness(bots, bots_per_guild, shard_count, db_latency, traced=False):
+    sink = SendSink()
+    bot, table = build_world(sink, bots, bots_per_guild, shard_count, db_latency)
+    # 偽のギルド/メンバーと登録行はBOT本体のメモリには含めない
+    bot.baseline = tracemalloc.get_traced_memory()[0] if traced else 0
+    cog = create_cog(bot, table, MemoryHistoryTable(db_latency))
+    try:
+        yield cog, bot, sink
+    finally:
+        cog.tracker.close()
+        cog.checks.clear()
+        if cog.check_runner is not None:
+            cog.check_runner.cancel()
+        await cog.dispatcher.close()
+
+
+def print_results(results):
+    columns = ('bots', 'guilds', 'cold_sweep_ms', 'cold_queries', 'warm_sweep_ms', 'warm_queries',
+               'memory_mb', 'detect_p50_ms', 'detect_max_ms')
+    print(' '.join(f"{column:>14}" for column in columns))
+    for result in results:
+        cells = []
+        for column in columns:
+            value = result.get(column)
+            cells.append(f"{value:>14.1f}" if isinstance(value, float) else f"{str(value):>14}")
+        print(' '.join(cells))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bots', default='100,1000,10000', help='カンマ区切りの監視BOT数')
+    parser.add_argument('--bots-per-guild', type=int, default=5)
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--db-latency', type=float, default=0.001, help='1クエリあたりの疑似レイテンシ(秒)')
+    parser.add_argument('--samples', type=int, default=5, help='検知遅延を測るBOT数')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(0)
+    results = []
+    for bots in (int(value) for value in args.bots.split(',')):
+        results.append(await run_case(bots, args.bots_per_guild, args.shards, args.db_latency, args.samples))
+    print_results(results)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -16,9 +16,14 @@ class ManagementBotCog(commands.Cog):
     async def ping(self, ctx):
         """BotのPingを表示します"""
         start_time = time.monotonic()
-        api_ping = await api.measure_api_ping()
-
-        if not api_ping:
+        # バックグラウンドで計測済みの値から応答し、まだ計測値がない場合だけその場で計測する
+        if not api.sampler.rest:
+            await api.sampler.sample()
+        rest = api.sampler.rest.percentiles()
+        gateway = api.sampler.gateway.percentiles()
+        api_ping = rest[50]
+
+        if not api_ping or api.sampler.is_degraded():
             color = discord.Color.red()
         else:
             color = discord.Color.green()
@@ -26,6 +31,8 @@ class ManagementBotCog(commands.Cog):
         e = discord.Embed(title="Pong!", color=color)
         e.add_field(name="API Ping", value=f"{round(api_ping)}ms" if api_ping else "測定失敗", inline=True)
         e.add_field(name="WebSocket Ping", value=f"{round(self.bot.latency * 1000)}ms", inline=True)
+        e.add_field(name="API p50/p95/p99", value=format_percentiles(rest), inline=False)
+        e.add_field(name="WebSocket p50/p95/p99", value=format_percentiles(gateway), inline=False)
         sent_message = await ctx.send(embed=e)
         end_time = time.monotonic()
 
@@ -34,5 +41,10 @@ class ManagementBotCog(commands.Cog):
         e.add_field(name="Bot Ping", value=f"{bot_ping}ms", inline=True)
         await sent_message.edit(embed=e)
 
+def format_percentiles(percentiles):
+    if percentiles[50] is None:
+        return "計測中"
+    return " / ".join(f"{round(value)}ms" for value in percentiles.values())
+
 async def setup(bot):
     await bot.add_cog(ManagementBotCog(bot))
\ No newline at end of file
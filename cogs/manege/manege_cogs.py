@@ -1,26 +1,17 @@
 from discord.ext import commands
 import discord
-import pathlib
 from discord import app_commands
 from typing import List
 
+from utils.extensions import manifest, sync_tree_if_changed
+
 class ManagementCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
                 
     def _get_available_cogs(self):
-        folder_name = 'cogs'
-        cur = pathlib.Path('.')
-        
-        available_cogs = []
-        for p in cur.glob(f"{folder_name}/**/*.py"):
-            if p.stem == "__init__":
-                continue
-            module_path = p.relative_to(cur).with_suffix('').as_posix().replace('/', '.')
-            if module_path.startswith('cogs.'):
-                available_cogs.append(module_path)
-        print(available_cogs)
-        return available_cogs
+        # ディレクトリに変更がない限りキャッシュした一覧を返す
+        return manifest.modules()
 
     async def cog_autocomplete(
         self, 
@@ -55,12 +46,12 @@ class ManagementCog(commands.Cog):
 
         try:
             await self.bot.reload_extension(cog)
-            await self.bot.tree.sync()
+            await sync_tree_if_changed(self.bot)
             await interaction.followup.send(f"{cog}を再読み込みしました。")
         except commands.ExtensionNotLoaded:
             await interaction.followup.send(f"'{cog}' は読み込まれていません。")
         except commands.ExtensionFailed as e:
-            await interaction.response.send_message(f"'{cog}' の再読み込み中にエラーが発生しました。\n{type(e).__name__}: {e}")
+            await interaction.followup.send(f"'{cog}' の再読み込み中にエラーが発生しました。\n{type(e).__name__}: {e}")
 
     @commands.hybrid_command(name='list_cogs', with_app_command=True)
     @commands.is_owner()
@@ -4,105 +4,291 @@ from discord import app_commands
 from discord.app_commands import command
 from discord.ext.commands import Cog  # 修正
 
+import asyncio
+import io
 import logging
-import traceback
-from datetime import datetime, timedelta, timezone
+import os
+import random
+import secrets
+import time
+from typing import Literal, Optional
+from datetime import datetime, timedelta
 
-from utils.db.table import BotTable
+from utils import api
+from utils.columns import DeadlineColumns
+from utils.correlation import OutageCorrelator
+from utils.db.table import OUTBOX_MAX_ATTEMPTS, BotTable, HistoryTable
 from utils.db.db import Database
-from utils.logger import MyLogger
+from utils.flap import FlapDetector
+from utils.members import all_members, is_lazy, load_members, search_members
+from utils.metrics import SWEEP_BOTS, SWEEP_SECONDS
+from utils.monitor import DEFAULT_CHECK_INTERVAL, MonitoredBot, PresenceTracker, to_epoch
+from utils.notifier import NotificationDispatcher
+from utils.prober import HttpProber, start_heartbeat_server, validate_url
+from utils.registry import RegistryCache
+from utils.render import format_duration, is_valid_zone, render_incident, render_status
+from utils.scheduler import DueScheduler
+from utils.sharding import ShardLeaseManager
+from utils.snapshot import MonitorSnapshot
+from utils.statecache import StateCache
+from utils.subscriptions import Subscription, SubscriptionIndex
+from utils.transfer import TransferError, dump_rows, load_rows
+from utils.uptime import floor_hour
+
+logger = logging.getLogger('health-check')
+
+OUTBOX_BATCH = 100
 
 class DatabaseSetup:
     def __init__(self):
         self.db = Database()
-        self.db_connection = self.db.connect()
-        if self.db_connection is None:
-            logging.error("データベースへの接続に失敗しました。")
-            return
+        self.db_connection = None
         self.bot_table = BotTable(self.db)
 
-    def create_tables(self):
-        self.bot_table.create_dm_table()
-        self.bot_table.create_channel_table()
+    async def connect(self):
+        self.db_connection = await self.db.connect()
+        if self.db_connection is None:
+            logger.error("データベースへの接続に失敗しました。")
+        return self.db_connection
+
+    async def create_tables(self):
+        await self.bot_table.migrate()
 
-    def close_connection(self):
-        self.db.close()
+    async def close_connection(self):
+        await self.db.close()
 
-    def reset_tables(self):
-        self.bot_table.drop_table()
-        self.create_tables()
+    async def reset_tables(self):
+        await self.bot_table.reset_table()
+        await self.create_tables()
 
 class HealthCheckGroup(Cog):  # 修正
     def __init__(self, bot, db):
         self.bot = bot
         self.db = BotTable(db)
+        self.history = HistoryTable(db)
+        self.tracker = PresenceTracker(self.notify_offline, self.notify_online, on_change=self.record_status, hold=self.hold_alert,
+                                       flaps=FlapDetector(), on_unstable=self.notify_unstable)
+        self.events = []
+        self.leases = ShardLeaseManager(db)
+        self.leases_ready = asyncio.Event()
+        self.checks = DueScheduler()
+        self.check_runner = None
+        self.prober = HttpProber()
+        self.probes = DueScheduler()
+        self.probe_runner = None
+        self.probe_tasks = set()
+        self.heartbeat_server = None
+        # ハートビートの期限はBOTを辿らずにまとめて判定できるよう列で保持する
+        self.heartbeats = DeadlineColumns()
+        self.dispatcher = NotificationDispatcher(bot)
+        self.correlator = OutageCorrelator()
+        incident_channel_id = os.getenv('INCIDENT_CHANNEL_ID')
+        self.incident_channel_id = int(incident_channel_id) if incident_channel_id else None
+        self.registry = RegistryCache()
+        self.subscriptions = SubscriptionIndex()
+        self.states = StateCache(self.db.save_bot_states)
+        self.snapshot = MonitorSnapshot(snapshot_path(bot))
+        # presence の取得が完了したシャード。それ以外のシャードのBOTは通知を保留する
+        self.presence_ready = set()
+        self.flush_task = None
+        self.drain_task = None
+        self.drain_requested = False
+        self.closing = False
+        self.renew_leases.start()
         self.check_bots.start()
-        self.log_setup()
-        logging.debug('HealthCheckGroup initialized')
-
-    def log_setup(self):
-        logger = MyLogger('health-check')
-        logger.setLevel(logging.DEBUG)
-        handler = logging.StreamHandler()
-        handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        logging.getLogger('health-check').addHandler(handler)
-        logging.getLogger('health-check').setLevel(logging.DEBUG)
-
-    def cog_unload(self):
-        self.db.close_connection()
+        self.roll_up_history.start()
+        self.watch_incidents.start()
+        self.check_heartbeats.start()
+        self.flush_loop.start()
+        self.drain_loop.start()
+        logger.debug('HealthCheckGroup initialized')
+
+    async def cog_load(self):
+        if self.snapshot.load() and self.snapshot.sessions:
+            # discord.py はキャッシュを READY からしか構築できないため、別プロセスのセッションは再開せず記録だけ残す
+            logger.info("前回のゲートウェイセッション: %s", self.snapshot.sessions)
+        heartbeat_port = os.getenv('HEARTBEAT_PORT')
+        if heartbeat_port:
+            self.heartbeat_server = await start_heartbeat_server(int(heartbeat_port), self.receive_heartbeat,
+                                                                 os.getenv('HEARTBEAT_HOST', '0.0.0.0'))
+
+    async def cog_unload(self):
+        # 送信待ちの通知は書き込みだけ行い、送信は再起動後または他のワーカーのドレイナーに任せる
+        self.closing = True
+        self.renew_leases.cancel()
         self.check_bots.cancel()
+        self.roll_up_history.cancel()
+        self.watch_incidents.cancel()
+        self.check_heartbeats.cancel()
+        self.flush_loop.cancel()
+        self.drain_loop.cancel()
+        if self.drain_task is not None:
+            self.drain_task.cancel()
+        if self.check_runner is not None:
+            self.check_runner.cancel()
+        if self.probe_runner is not None:
+            self.probe_runner.cancel()
+        for task in self.probe_tasks:
+            task.cancel()
+        if self.heartbeat_server is not None:
+            await self.heartbeat_server.cleanup()
+        await self.prober.close()
+        self.snapshot.save(self.tracker.bots.values(), self.gateway_sessions())
+        self.tracker.close()
+        await self.dispatcher.close()
+        await self.flush_states()
+        await self.leases.release()
+        await self.db.db.close()
 
     async def bot_list_autocomplete(self, interaction: discord.Interaction, current: str):
-        your_bots = self.db.get_bots(interaction.user.id, interaction.guild.id)
-        choices = []
-        for bot in your_bots:
-            if current in bot['name']:
-                choices.append(app_commands.Choice(name=bot['name'], value=bot['id']))
-                logging.debug(f"{bot['name']}: {bot['id']}")
-        return choices
-    
+        registry = self.registry.guild(interaction.guild)
+        return [app_commands.Choice(name=name, value=str(bot_id))
+                for bot_id, name in registry.search_registered(current, user_id=interaction.user.id)]
+
     async def bot_autocomplete(self, interaction: discord.Interaction, current: str):
-        server_bots = [member for member in interaction.guild.members if member.bot]
-        choices = []
-        current_lower = current.lower()
-        for bot in server_bots:
-            if current_lower in bot.name.lower():
-                choices.append(app_commands.Choice(name=bot.name, value=str(bot.id)))
-                logging.debug(f"{bot.name}: {bot.id}")
+        registry = self.registry.guild(interaction.guild)
+        # 低メモリモードでは監視中のBOTしかキャッシュにないため、未検索の入力はゲートウェイで検索する。
+        # 空の入力ではゲートウェイを検索できないため、キャッシュにある分だけを返す
+        if current and is_lazy(interaction.guild) and registry.needs_search(current):
+            members = await search_members(interaction.guild, current)
+            if members is not None:
+                for member in members:
+                    if member.bot:
+                        registry.members.add(member.id, member.name)
+                if len(members) < 25:
+                    registry.mark_searched(current)
+        choices = [app_commands.Choice(name=name, value=str(bot_id)) for bot_id, name in registry.search_members(current)]
         if not choices:
             choices.append(app_commands.Choice(name="選択肢が見つかりません", value="none"))
         return choices
 
+    async def registered_autocomplete(self, interaction: discord.Interaction, current: str):
+        registry = self.registry.guild(interaction.guild)
+        return [app_commands.Choice(name=name, value=str(bot_id))
+                for bot_id, name in registry.search_registered(current)]
+
+    @Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.registry.add_member(member)
+
+    @Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.registry.remove_member(member)
+
+    @Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.name != after.name:
+            self.registry.add_member(after)
+
+    @Cog.listener()
+    async def on_shard_ready(self, shard_id: int):
+        # 再接続でキャッシュが作り直された場合は、そのシャードを同期し直すまで通知を保留する
+        self.presence_ready.discard(shard_id)
+        if not self.leases_ready.is_set():
+            return
+        if self.leases.owns(shard_id):
+            try:
+                await self.sync_guilds({guild.id: guild for guild in self.bot.guilds if guild.shard_id == shard_id})
+            except Exception as e:
+                logger.exception("Error: %s", e)
+                return
+        self.presence_ready.add(shard_id)
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.registry.drop_guild(guild.id)
+        self.subscriptions.drop_guild(guild.id)
+
     @app_commands.command(name='add', description='BOTを監視リストに追加します。')  # 修正
     @app_commands.autocomplete(bot=bot_autocomplete)
     @app_commands.describe(bot='BOTを選択してください。')
     async def add_bot(self, interaction, bot: str):
-        bot_member = interaction.guild.get_member(int(bot))
+        if not bot.isdigit():
+            await interaction.response.send_message("BOTを選択してください。")
+            return
+        # 低メモリモードではメンバーの取得にゲートウェイへの問い合わせが必要になり、3秒の応答期限を超えうるため先に応答を保留する
+        await interaction.response.defer(thinking=True)
+        # 監視を始めたBOTは presence の更新を受け取れるようキャッシュに追加する
+        members = await load_members(interaction.guild, [int(bot)], presences=self.bot.intents.presences, cache=True)
+        bot_member = members.get(int(bot))
         if bot_member is None or not bot_member.bot:
-            await interaction.response.send_message("指定されたユーザーはBOTではありません。")
+            await interaction.edit_original_response(content="指定されたユーザーはBOTではありません。")
             return
-        self.db.add_bot(interaction.user.id, bot_member.id, bot_member.name, datetime.utcnow(), interaction.guild.id)
-        await interaction.response.send_message(f"{bot_member.name}を監視リストに追加しました。")
+        inserted, owner_id = await self.db.add_bot(interaction.user.id, bot_member.id, bot_member.name, datetime.utcnow(), interaction.guild.id)
+        if not inserted:
+            # 登録者は変えず、キャッシュも登録済みの所有者のままにする
+            self.registry.register(interaction.guild.id, bot_member.id, owner_id, bot_member.name)
+            await interaction.edit_original_response(content=f"{bot_member.name}は既に監視リストに登録されています。")
+            return
+        self.subscriptions.add(Subscription(interaction.guild.id, bot_member.id, 'user', interaction.user.id))
+        if self.leases.owns(interaction.guild.shard_id):
+            monitored = self.tracker.track(MonitoredBot(interaction.guild.id, bot_member.id, interaction.user.id, bot_member.name, last_online=time.time()))
+            self.states.mark(monitored)
+            self.events.append((interaction.guild.id, bot_member.id, True, datetime.utcnow()))
+            self.tracker.observe(interaction.guild.id, bot_member.id, is_up(bot_member))
+            self.schedule_check(self.tracker.get(interaction.guild.id, bot_member.id))
+            self.update_population()
+        self.registry.register(interaction.guild.id, bot_member.id, interaction.user.id, bot_member.name)
+        await interaction.edit_original_response(content=f"{bot_member.name}を監視リストに追加しました。")
 
     @app_commands.command(name='channel_add', description='チャンネルに通知を送信するBOTを追加します。')  # 修正
-    @app_commands.autocomplete(bot=bot_autocomplete)
+    @app_commands.autocomplete(bot=registered_autocomplete)
     @app_commands.describe(bot='BOTを選択してください。')
     @app_commands.describe(channel='通知を送信するチャンネルを選択してください。')
     async def add_channel(self, interaction: discord.Interaction, bot: str, channel: discord.TextChannel):
-        bot_member = interaction.guild.get_member(int(bot))
-        if bot_member is None or not bot_member.bot:
-            await interaction.response.send_message("指定されたユーザーはBOTではありません。")
-            return
+        await self.change_subscription(interaction, bot, 'channel', channel.id, True)
+
+    @app_commands.command(name='subscribe', description='BOTの通知を受け取る送信先を追加します。')
+    @app_commands.autocomplete(bot=registered_autocomplete)
+    @app_commands.describe(bot='BOTを選択してください。')
+    @app_commands.describe(channel='通知を送信するチャンネル。チャンネルもWebhookも省略するとあなたのDMに送信します。')
+    @app_commands.describe(webhook='通知を送信するWebhookのURL')
+    async def subscribe(self, interaction: discord.Interaction, bot: str,
+                        channel: Optional[discord.TextChannel] = None, webhook: Optional[str] = None):
+        kind, target = subscription_target(interaction, channel, webhook)
+        await self.change_subscription(interaction, bot, kind, target, True)
 
-        self.db.add_channel(bot_member.id, channel.id, channel.name)
-        await interaction.response.send_message(f"{channel.mention}に{bot_member.mention}の通知を追加しました。")
+    @app_commands.command(name='unsubscribe', description='BOTの通知の送信先を削除します。')
+    @app_commands.autocomplete(bot=registered_autocomplete)
+    @app_commands.describe(bot='BOTを選択してください。')
+    @app_commands.describe(channel='削除するチャンネル。チャンネルもWebhookも省略するとあなたのDMへの通知を削除します。')
+    @app_commands.describe(webhook='削除するWebhookのURL')
+    async def unsubscribe(self, interaction: discord.Interaction, bot: str,
+                          channel: Optional[discord.TextChannel] = None, webhook: Optional[str] = None):
+        kind, target = subscription_target(interaction, channel, webhook)
+        await self.change_subscription(interaction, bot, kind, target, False)
+
+    async def change_subscription(self, interaction: discord.Interaction, bot: str, kind: str, target, add: bool):
+        registry = self.registry.guild(interaction.guild)
+        if not bot.isdigit() or int(bot) not in registry.registered:
+            await interaction.response.send_message("指定されたBOTは監視リストに登録されていません。")
+            return
+        # 自分のDM以外の送信先はBOTの登録者かサーバー管理者のみ変更できる
+        if kind != 'user' and registry.owners.get(int(bot)) != interaction.user.id \
+                and not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("送信先を変更するにはBOTの登録者かサーバー管理権限が必要です。")
+            return
+        if kind == 'webhook':
+            try:
+                discord.Webhook.from_url(target, session=api.http.session)
+            except ValueError:
+                await interaction.response.send_message("WebhookのURLが正しくありません。", ephemeral=True)
+                return
+        subscription = Subscription(interaction.guild.id, int(bot), kind, target)
+        label = {'channel': f"<#{target}>", 'user': "あなたのDM", 'webhook': "Webhook"}[kind]
+        if add:
+            await self.db.add_subscription(interaction.guild.id, int(bot), kind, target, interaction.user.id)
+            self.subscriptions.add(subscription)
+            message = f"{label}に<@{bot}>の通知を追加しました。"
+        else:
+            await self.db.remove_subscription(interaction.guild.id, int(bot), kind, target)
+            self.subscriptions.remove(subscription)
+            message = f"{label}への<@{bot}>の通知を削除しました。"
+        await interaction.response.send_message(message, ephemeral=kind == 'webhook')
 
     @app_commands.command(name='list', description='あなたが登録しているBOTのリストを表示します。')  # 修正
     async def list_bots(self, interaction):
-        bots = self.db.get_bots(interaction.user.id, interaction.guild.id)
+        bots = await self.db.get_user_bots(interaction.user.id, interaction.guild.id)
         bot_names = ', '.join(bot['name'] for bot in bots)
         e = discord.Embed(title='登録されているBOT', description=bot_names)
         e.set_footer(text=f"{len(bots)}個のBOTが登録されています。")
@@ -112,151 +298,683 @@ class HealthCheckGroup(Cog):  # 修正
     @app_commands.autocomplete(bot=bot_list_autocomplete)
     @app_commands.describe(bot='BOTを選択してください。')
     async def remove_bot(self, interaction, bot: str):
-        self.db.remove_bot(bot)
+        if not bot.isdigit():
+            await interaction.response.send_message("BOTを選択してください。")
+            return
+        # 削除できるのはこのサーバーで自分が登録したBOTのみ。サーバー管理者は全ての登録を削除できる
+        owner = None if interaction.user.guild_permissions.manage_guild else interaction.user.id
+        if not await self.db.remove_bot(interaction.guild.id, int(bot), owner):
+            await interaction.response.send_message("指定されたBOTはあなたの監視リストに登録されていません。")
+            return
+        self.untrack(interaction.guild.id, int(bot))
+        self.registry.unregister(interaction.guild.id, int(bot))
+        self.update_population()
         await interaction.response.send_message("指定されたBOTをリストから削除しました。")
 
-    @tasks.loop(minutes=1)
+    @app_commands.command(name='bulk_add', description='サーバー内のBOTをまとめて監視リストに追加します。')
+    @app_commands.describe(role='指定するとこのロールを持つBOTだけを追加します。')
+    async def bulk_add(self, interaction: discord.Interaction, role: Optional[discord.Role] = None):
+        if not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("まとめて追加するにはサーバー管理権限が必要です。")
+            return
+        await interaction.response.defer(thinking=True)
+        registry = self.registry.guild(interaction.guild)
+        members = await all_members(interaction.guild)
+        rows = [{'bot_id': member.id, 'name': member.name} for member in members
+                if member.bot and member.id != self.bot.user.id and member.id not in registry.registered
+                and (role is None or role in member.roles)]
+        if not rows:
+            await interaction.edit_original_response(content="追加できるBOTが見つかりませんでした。")
+            return
+        await interaction.edit_original_response(content=f"{len(rows)}件のBOTを登録しています...")
+        added = await self.db.add_bots(interaction.guild.id, rows, interaction.user.id)
+        await self.refresh_guild(interaction.guild)
+        await interaction.edit_original_response(content=f"{added}件のBOTを監視リストに追加しました。")
+
+    @app_commands.command(name='export', description='このサーバーの監視リストをファイルに書き出します。')
+    @app_commands.describe(format='ファイル形式')
+    async def export_bots(self, interaction: discord.Interaction, format: Literal['json', 'csv'] = 'json'):
+        if not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("書き出すにはサーバー管理権限が必要です。")
+            return
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        bots, subscriptions = await asyncio.gather(self.db.get_bots(interaction.guild.id),
+                                                   self.db.get_subscriptions([interaction.guild.id]))
+        channels = {}
+        for subscription in subscriptions:
+            if subscription['kind'] == 'channel':
+                channels.setdefault(subscription['bot_id'], []).append(int(subscription['target']))
+        rows = [dict(row, channels=channels.get(row['bot_id'], [])) for row in bots]
+        data = dump_rows(rows, format)
+        await interaction.followup.send(f"{len(rows)}件のBOTを書き出しました。",
+                                        file=discord.File(io.BytesIO(data), filename=f"bots-{interaction.guild.id}.{format}"))
+
+    @app_commands.command(name='import', description='ファイルから監視リストを読み込みます。')
+    @app_commands.describe(file='export で書き出した JSON または CSV ファイル')
+    async def import_bots(self, interaction: discord.Interaction, file: discord.Attachment):
+        if not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("読み込むにはサーバー管理権限が必要です。")
+            return
+        fmt = file.filename.rsplit('.', 1)[-1].lower()
+        if fmt not in ('json', 'csv') or file.size > 1024 * 1024:
+            await interaction.response.send_message("1MB以下の .json または .csv ファイルを指定してください。")
+            return
+        await interaction.response.defer(thinking=True)
+        try:
+            rows = load_rows(await file.read(), fmt)
+        except TransferError as e:
+            await interaction.edit_original_response(content=str(e))
+            return
+        await interaction.edit_original_response(content=f"{len(rows)}件を検証しています...")
+        accepted = []
+        members = await load_members(interaction.guild, [row['bot_id'] for row in rows])
+        # 登録者はこのサーバーのメンバーの場合だけファイルの値を使い、それ以外は読み込んだユーザーにする
+        owners = await load_members(interaction.guild, {row['user_id'] for row in rows if row['user_id'] is not None})
+        for row in rows:
+            member = members.get(row['bot_id'])
+            if member is None or not member.bot:
+                continue
+            owner = owners.get(row['user_id'])
+            row['user_id'] = owner.id if owner is not None and not owner.bot else interaction.user.id
+            row['name'] = row['name'] or member.name
+            row['channels'] = [channel_id for channel_id in row['channels'] if interaction.guild.get_channel(channel_id)]
+            accepted.append(row)
+        await interaction.edit_original_response(content=f"{len(accepted)}件を書き込んでいます...")
+        added = await self.db.add_bots(interaction.guild.id, accepted, interaction.user.id, overwrite=True)
+        await self.refresh_guild(interaction.guild)
+        skipped = len(rows) - len(accepted)
+        await interaction.edit_original_response(
+            content=f"{len(accepted)}件を読み込みました(新規 {added}件)。" + (f"\nサーバーにいないBOT {skipped}件はスキップしました。" if skipped else ""))
+
+    async def refresh_guild(self, guild: discord.Guild):
+        # まとめて変更した後は1回の同期で監視対象と購読を反映する
+        if self.leases.owns(guild.shard_id):
+            await self.sync_guilds({guild.id: guild})
+            self.update_population()
+            return
+        for row in await self.db.get_bots(guild.id):
+            self.registry.register(guild.id, row['bot_id'], row['user_id'], row['name'])
+
+    @app_commands.command(name='config', description='オフライン判定の猶予時間やチェック間隔を設定します。')
+    @app_commands.autocomplete(bot=bot_list_autocomplete)
+    @app_commands.describe(bot='設定するBOTを選択してください。省略するとサーバー全体の既定値を設定します。')
+    @app_commands.describe(grace='オフライン通知までの猶予時間(分)。省略すると既定値に戻します。')
+    @app_commands.describe(interval='ステータスのチェック間隔(秒)。省略すると既定値に戻します。')
+    @app_commands.describe(renotify='オフライン通知を再送する間隔(分)。省略すると既定値に戻します。')
+    async def config(self, interaction: discord.Interaction,
+                     grace: Optional[app_commands.Range[int, 0, 1440]] = None,
+                     interval: Optional[app_commands.Range[int, 10, 3600]] = None,
+                     renotify: Optional[app_commands.Range[int, 1, 1440]] = None,
+                     bot: Optional[str] = None):
+        grace_seconds = grace * 60 if grace is not None else None
+        renotify_seconds = renotify * 60 if renotify is not None else None
+        if bot is None:
+            if not interaction.user.guild_permissions.manage_guild:
+                await interaction.response.send_message("サーバーの既定値を変更するにはサーバー管理権限が必要です。")
+                return
+        else:
+            if not bot.isdigit():
+                await interaction.response.send_message("BOTを選択してください。", ephemeral=True)
+                return
+            registry = self.registry.guild(interaction.guild)
+            if registry.owners.get(int(bot)) != interaction.user.id:
+                await interaction.response.send_message("指定されたBOTはあなたの監視リストに登録されていません。")
+                return
+        # 書き込みと同期(メンバーの取得を含む)は3秒の応答期限を超えうるため先に応答を保留する
+        await interaction.response.defer(thinking=True)
+        if bot is None:
+            await self.db.update_guild_settings(interaction.guild.id, grace_seconds, interval, renotify_seconds)
+        else:
+            await self.db.update_bot_settings(interaction.guild.id, int(bot), grace_seconds, interval, renotify_seconds)
+
+        if self.leases.owns(interaction.guild.shard_id):
+            for row in await self.sync_guilds({interaction.guild.id: interaction.guild}):
+                self.schedule_check(self.tracker.get(row['guild_id'], row['bot_id']), jitter=True)
+        target = f"<@{bot}>" if bot else "サーバーの既定値"
+        await interaction.edit_original_response(content=f"{target}の設定を更新しました。")
+
+    @app_commands.command(name='probe', description='プレゼンスに加えて使うヘルスチェックを設定します。')
+    @app_commands.autocomplete(bot=bot_list_autocomplete)
+    @app_commands.describe(bot='設定するBOTを選択してください。')
+    @app_commands.describe(kind='http: URLへ定期的にリクエスト / heartbeat: BOTからの定期的な通知を待つ / none: 解除')
+    @app_commands.describe(url='kind が http の場合のヘルスチェックURL')
+    @app_commands.describe(interval='チェック間隔(秒)。heartbeat の場合は送信間隔を指定してください。')
+    @app_commands.describe(timeout='タイムアウト(秒)')
+    async def set_probe(self, interaction: discord.Interaction, bot: str, kind: Literal['http', 'heartbeat', 'none'],
+                        url: Optional[str] = None,
+                        interval: app_commands.Range[int, 30, 3600] = 60,
+                        timeout: app_commands.Range[int, 1, 60] = 10):
+        if not bot.isdigit():
+            await interaction.response.send_message("BOTを選択してください。", ephemeral=True)
+            return
+        registry = self.registry.guild(interaction.guild)
+        if registry.owners.get(int(bot)) != interaction.user.id:
+            await interaction.response.send_message("指定されたBOTはあなたの監視リストに登録されていません。")
+            return
+        if kind == 'http' and (not url or not url.startswith(('http://', 'https://'))):
+            await interaction.response.send_message("http の場合は http:// または https:// で始まるURLを指定してください。")
+            return
+        # URLの名前解決・書き込み・同期は3秒の応答期限を超えうるため先に応答を保留する。トークンを含む応答は本人にだけ表示する
+        await interaction.response.defer(thinking=True, ephemeral=kind == 'heartbeat')
+        if kind == 'none':
+            await self.db.remove_probe(interaction.guild.id, int(bot))
+            message = f"<@{bot}>のヘルスチェックを解除しました。"
+        elif kind == 'http':
+            error = await validate_url(url)
+            if error is not None:
+                await interaction.edit_original_response(content=error)
+                return
+            await self.db.set_probe(interaction.guild.id, int(bot), kind, url, None, interval, timeout)
+            message = f"<@{bot}>のヘルスチェックを設定しました: {url}"
+        else:
+            token = secrets.token_urlsafe(24)
+            await self.db.set_probe(interaction.guild.id, int(bot), kind, None, token, interval, timeout)
+            base = os.getenv('HEARTBEAT_URL', '').rstrip('/')
+            message = f"<@{bot}>のハートビートを設定しました。{interval}秒ごとに次のURLへリクエストを送信してください。\n`{base}/heartbeat/{token}`"
+
+        if self.leases.owns(interaction.guild.shard_id):
+            await self.sync_guilds({interaction.guild.id: interaction.guild})
+        await interaction.edit_original_response(content=message)
+
+    @app_commands.command(name='timezone', description='通知に表示するタイムゾーンと言語を設定します。')
+    @app_commands.describe(timezone='IANA形式のタイムゾーン(例: Asia/Tokyo)。省略すると既定値に戻します。')
+    @app_commands.describe(locale='通知の言語。省略すると既定値に戻します。')
+    async def set_timezone(self, interaction: discord.Interaction, timezone: Optional[str] = None,
+                           locale: Optional[Literal['ja', 'en']] = None):
+        if not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("サーバーの既定値を変更するにはサーバー管理権限が必要です。")
+            return
+        if timezone is not None and not is_valid_zone(timezone):
+            await interaction.response.send_message(f"タイムゾーン {timezone} が見つかりません。")
+            return
+        await self.db.update_guild_locale(interaction.guild.id, locale, timezone)
+        for monitored in self.tracker.bots.values():
+            if monitored.guild_id == interaction.guild.id:
+                monitored.locale = locale
+                monitored.timezone = timezone
+        await interaction.response.send_message("通知のタイムゾーンと言語を更新しました。")
+
+    @app_commands.command(name='uptime', description='BOTの稼働率と障害履歴を表示します。')
+    @app_commands.autocomplete(bot=registered_autocomplete)
+    @app_commands.describe(bot='BOTを選択してください。')
+    @app_commands.describe(days='集計する日数を指定してください。')
+    async def uptime(self, interaction: discord.Interaction, bot: str, days: app_commands.Range[int, 1, 90] = 30):
+        if not bot.isdigit():
+            await interaction.response.send_message("BOTを選択してください。", ephemeral=True)
+            return
+        end = datetime.utcnow()
+        stats = await self.history.get_uptime(interaction.guild.id, int(bot), end - timedelta(days=days), end)
+        if stats.uptime is None:
+            await interaction.response.send_message("集計データがまだありません。")
+            return
+        e = discord.Embed(title='稼働状況', description=f"<@{bot}> の過去{days}日間の稼働状況です。", color=discord.Color.blue())
+        e.add_field(name='稼働率', value=f"{stats.uptime:.3f}%")
+        e.add_field(name='障害回数', value=f"{stats.outages}回")
+        e.add_field(name='平均復旧時間', value=str(stats.mttr).split('.')[0] if stats.mttr else 'なし')
+        e.set_footer(text="1時間ごとの集計から算出しています。")
+        await interaction.response.send_message(embed=e)
+
+    @Cog.listener()
+    async def on_presence_update(self, before: discord.Member, after: discord.Member):
+        if not after.bot or before.status == after.status or not self.leases.owns(after.guild.shard_id):
+            return
+        self.tracker.observe(after.guild.id, after.id, is_up(after))
+
+    def hold_alert(self, monitored: MonitoredBot):
+        # 起動・再接続の直後は presence が揃うまでオフラインに見えるBOTがあるため通知を保留する
+        if self.shard_of(monitored) not in self.presence_ready:
+            logger.info("presence の取得中のため %s の通知を保留します。", monitored.name)
+            return True
+        # Discord側が劣化している間は誤検知の可能性が高いため通知を保留する
+        if api.sampler.is_degraded():
+            logger.info("Discord APIが不安定なため %s の通知を保留します。", monitored.name)
+            return True
+        # 多数のBOTが同時にオフラインになっている間は個別の通知をまとめて1件にする
+        if self.correlator.is_suppressed(self.shard_of(monitored)):
+            logger.info("障害を検知しているため %s の通知を保留します。", monitored.name)
+            return True
+        return False
+
+    def gateway_sessions(self):
+        sessions = {}
+        for shard_id, shard in (getattr(self.bot, 'shards', None) or {}).items():
+            ws = getattr(getattr(shard, '_parent', None), 'ws', None)
+            if ws is not None and ws.session_id:
+                sessions[shard_id] = [ws.session_id, ws.sequence]
+        return sessions
+
+    def shard_of(self, monitored: MonitoredBot):
+        guild = self.bot.get_guild(monitored.guild_id)
+        return guild.shard_id if guild else None
+
+    def update_population(self):
+        per_shard = {}
+        for monitored in self.tracker.bots.values():
+            shard_id = self.shard_of(monitored)
+            per_shard[shard_id] = per_shard.get(shard_id, 0) + 1
+        self.correlator.set_population(len(self.tracker), per_shard)
+
+    async def notify_incident(self, incident, resolved=False):
+        if resolved:
+            logger.info("障害が収束しました(%s): 影響を受けたBOT %d件", incident.scope, len(incident.affected))
+        else:
+            logger.warning("障害を検知しました(%s): %d件のBOTが短時間にオフラインになりました。", incident.scope, len(incident.affected))
+        if self.incident_channel_id:
+            await self.dispatcher.send_channel(self.incident_channel_id, render_incident(incident, resolved))
+
+    async def notify_offline(self, monitored: MonitoredBot):
+        guild = self.bot.get_guild(monitored.guild_id)
+        bot_member = guild.get_member(monitored.bot_id) if guild else None
+        if bot_member is None:
+            return
+        grace = self.tracker.grace_for(monitored)
+        logger.debug("%sがオフラインになって%sが経過しました。", bot_member.name, format_duration(grace))
+        e = render_status('offline', monitored, bot_member.name, grace)
+        monitored.last_channel_online_notified = None
+        monitored.last_dm_online_notified = None
+        channel_sent, dm_sent = self.enqueue_notification(monitored, 'offline', e, monitored.last_notified)
+        if channel_sent:
+            monitored.last_channel_notified = time.time()
+        if dm_sent:
+            monitored.last_dm_notified = time.time()
+
+    async def notify_online(self, monitored: MonitoredBot):
+        guild = self.bot.get_guild(monitored.guild_id)
+        bot_member = guild.get_member(monitored.bot_id) if guild else None
+        if bot_member is None:
+            return
+        e = render_status('online', monitored, bot_member.name)
+        channel_sent, dm_sent = self.enqueue_notification(monitored, 'online', e, monitored.last_online)
+        if channel_sent:
+            monitored.last_channel_online_notified = time.time()
+        if dm_sent:
+            monitored.last_dm_online_notified = time.time()
+
+    async def notify_unstable(self, monitored: MonitoredBot):
+        guild = self.bot.get_guild(monitored.guild_id)
+        bot_member = guild.get_member(monitored.bot_id) if guild else None
+        e = render_status('unstable', monitored, bot_member.name if bot_member else monitored.name)
+        channel_sent, dm_sent = self.enqueue_notification(monitored, 'unstable', e, time.time())
+        # 不安定の間は復帰通知を送らないため、オフライン通知と同じ扱いで記録する
+        if channel_sent:
+            monitored.last_channel_notified = time.time()
+        if dm_sent:
+            monitored.last_dm_notified = time.time()
+
+    def routes(self, monitored: MonitoredBot):
+        # 全ての購読先を (kind, target) のリストで返す。登録者のDMも登録時に追加した購読として含まれる
+        routes = []
+        for subscription in self.subscriptions.targets(monitored.guild_id, monitored.bot_id):
+            if subscription.kind in ('user', 'webhook') or self.channel_in_guild(subscription.target, monitored.guild_id):
+                routes.append((subscription.kind, subscription.target))
+        if not routes:
+            logger.debug("通知の送信先が見つかりません。")
+        return routes
+
+    def enqueue_notification(self, monitored: MonitoredBot, event: str, e: discord.Embed, occurred_at: float):
+        # 通知は状態と同じトランザクションで notification_outbox に書き込み、送信はドレイナーに任せる。
+        # 冪等キーは遷移ごとに一意なため、書き込みを再試行しても同じ通知が重複して追加されることはない
+        payload = e.to_dict()
+        stamp = f"{occurred_at or time.time():.3f}"
+        routes = self.routes(monitored)
+        self.states.enqueue(monitored, [(f"{event}:{monitored.guild_id}:{monitored.bot_id}:{stamp}:{kind}:{target}",
+                                         monitored.guild_id, monitored.bot_id, event, kind, target, payload)
+                                        for kind, target in routes])
+        self.schedule_flush()
+        # チャンネル(Webhookを含む)とDMのそれぞれに1件以上の送信先があるかを返す
+        return any(kind != 'user' for kind, _ in routes), any(kind == 'user' for kind, _ in routes)
+
+    def channel_in_guild(self, channel_id, guild_id):
+        # 旧 channels テーブルから移行した購読は別ギルドのチャンネルを含みうるため、そのギルドのチャンネルにだけ送る
+        channel = self.bot.get_channel(channel_id)
+        return channel is not None and getattr(channel, 'guild', None) is not None and channel.guild.id == guild_id
+
+    def mark_dirty(self, monitored: MonitoredBot):
+        # 状態遷移はメモリ上に記録し、flush_loop でまとめて書き込む
+        if self.states.mark(monitored):
+            self.schedule_flush()
+
+    def record_status(self, monitored: MonitoredBot, online: bool, occurred_at: datetime):
+        self.events.append((monitored.guild_id, monitored.bot_id, online, occurred_at))
+        self.mark_dirty(monitored)
+        if len(self.events) >= self.states.max_dirty:
+            self.schedule_flush()
+        for incident in self.correlator.record(monitored.key, self.shard_of(monitored), online, occurred_at):
+            asyncio.create_task(self.notify_incident(incident))
+
+    def schedule_flush(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_states())
+
+    async def flush_states(self):
+        if self.events:
+            events, self.events = self.events, []
+            try:
+                await self.history.insert_status_events(events)
+            except Exception as e:
+                self.events[:0] = events
+                logger.exception("Error: %s", e)
+        enqueued = bool(self.states.outbox)
+        try:
+            await self.states.flush()
+        except Exception as e:
+            logger.exception("Error: %s", e)
+            return
+        if enqueued:
+            self.schedule_drain()
+
+    def schedule_drain(self):
+        self.drain_requested = True
+        if self.closing:
+            return
+        if self.drain_task is None or self.drain_task.done():
+            self.drain_task = asyncio.create_task(self.drain_outbox())
+
+    async def drain_outbox(self):
+        # 書き込み済みの通知をバッチ単位で確保して送信する。確保中に追加された通知は続けて処理する
+        while self.drain_requested:
+            self.drain_requested = False
+            try:
+                while await self.drain_batch() >= OUTBOX_BATCH:
+                    pass
+            except Exception as e:
+                logger.exception("Error: %s", e)
+                return
+
+    async def drain_batch(self):
+        rows = await self.db.claim_notifications(self.leases.worker_id, limit=OUTBOX_BATCH)
+        if not rows:
+            return 0
+        results = await asyncio.gather(*(self.deliver(row) for row in rows))
+        await self.db.finish_notifications([row['id'] for row, sent in zip(rows, results) if sent])
+        for row, sent in zip(rows, results):
+            if not sent and row['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+                logger.error("通知の送信を%d回失敗したため諦めます: %s", row['attempts'], row['idempotency_key'])
+        return len(rows)
+
+    def deliver(self, row):
+        e = discord.Embed.from_dict(row['payload'])
+        if row['kind'] == 'webhook':
+            return self.dispatcher.send_webhook(row['target'], e)
+        if row['kind'] == 'channel':
+            return self.dispatcher.send_channel(int(row['target']), e)
+        return self.dispatcher.send_dm(int(row['target']), e)
+
+    @tasks.loop(seconds=15)
+    async def drain_loop(self):
+        # 他のワーカーが書き込んだ通知や、確保の期限が切れた送信失敗の通知を拾う
+        self.schedule_drain()
+
+    @drain_loop.before_loop
+    async def before_drain_loop(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=5)
+    async def flush_loop(self):
+        # 書き込みの間隔がクラッシュ時に失われうる状態遷移の上限になる。再起動後は check_bots の同期で補正される
+        await self.flush_states()
+
+    @tasks.loop(seconds=20)
+    async def renew_leases(self):
+        shard_ids = list(self.bot.shards) if getattr(self.bot, 'shards', None) else [0]
+        previous = set(self.leases.owned)
+        try:
+            owned = await self.leases.renew(shard_ids)
+        except Exception as e:
+            logger.exception("Error: %s", e)
+            return
+        for key, monitored in list(self.tracker.bots.items()):
+            guild = self.bot.get_guild(monitored.guild_id)
+            if guild is None or guild.shard_id not in owned:
+                self.untrack(*key)
+        if not self.leases_ready.is_set():
+            # 初回に取得したシャードは check_bots の最初の同期で評価を始める
+            self.leases_ready.set()
+            return
+        # 前のプロセスのリースが失効するまで取得できなかったシャードなど、後から取得したシャードは
+        # on_shard_ready と同じように同期してから評価を始める
+        gained = owned - previous
+        if not gained:
+            return
+        try:
+            await self.sync_guilds({guild.id: guild for guild in self.bot.guilds if guild.shard_id in gained})
+        except Exception as e:
+            logger.exception("Error: %s", e)
+            # 同期できなかったシャードは次回の更新で取得し直したものとして扱う
+            self.leases.owned -= gained
+            return
+        self.presence_ready.update(gained)
+        self.update_population()
+
+    @renew_leases.before_loop
+    async def before_renew_leases(self):
+        await self.bot.wait_until_ready()
+
+    def untrack(self, guild_id, bot_id):
+        self.tracker.untrack(guild_id, bot_id)
+        self.checks.cancel((guild_id, bot_id))
+        self.states.forget((guild_id, bot_id))
+        self.heartbeats.remove((guild_id, bot_id))
+        self.probes.cancel((guild_id, bot_id))
+
+    def schedule_check(self, monitored: MonitoredBot, jitter=False):
+        interval = (monitored.check_interval or DEFAULT_CHECK_INTERVAL).total_seconds()
+        self.checks.schedule_in(monitored.key, random.uniform(0, interval) if jitter else interval)
+
+    def evaluate(self, key):
+        # スケジューラから呼ばれ、期限が来たBOTだけをキャッシュ上のステータスで評価する
+        monitored = self.tracker.bots.get(key)
+        if monitored is None:
+            return
+        guild = self.bot.get_guild(monitored.guild_id)
+        bot_member = guild.get_member(monitored.bot_id) if guild else None
+        if bot_member is not None:
+            self.tracker.observe(monitored.guild_id, monitored.bot_id, is_up(bot_member))
+        self.schedule_check(monitored)
+
+    def schedule_probe(self, monitored: MonitoredBot, jitter=False):
+        if monitored.probe_kind != 'http' or not monitored.probe_url:
+            self.probes.cancel(monitored.key)
+            return
+        interval = monitored.probe_interval.total_seconds()
+        self.probes.schedule_in(monitored.key, random.uniform(0, interval) if jitter else interval * random.uniform(0.9, 1.1))
+        if self.probe_runner is None:
+            self.probe_runner = asyncio.create_task(self.probes.run(self.start_probe))
+
+    def start_probe(self, key):
+        monitored = self.tracker.bots.get(key)
+        if monitored is None:
+            return
+        task = asyncio.create_task(self.probe_bot(monitored))
+        self.probe_tasks.add(task)
+        task.add_done_callback(self.probe_tasks.discard)
+
+    async def probe_bot(self, monitored: MonitoredBot):
+        if monitored.probe_kind != 'http':
+            return
+        ok = await self.prober.check(monitored.probe_url, monitored.probe_timeout.total_seconds())
+        if self.tracker.get(*monitored.key) is monitored:
+            self.tracker.observe(monitored.guild_id, monitored.bot_id, ok, source='probe')
+            self.schedule_probe(monitored)
+
+    def apply_probe(self, monitored: MonitoredBot):
+        if monitored.probe_kind != 'heartbeat':
+            self.heartbeats.remove(monitored.key)
+        if monitored.probe_kind is None:
+            self.tracker.clear_source(monitored.guild_id, monitored.bot_id, 'probe')
+            self.probes.cancel(monitored.key)
+        elif monitored.probe_kind == 'heartbeat':
+            self.probes.cancel(monitored.key)
+            self.heartbeats.set(monitored.key, monitored.heartbeat_deadline())
+            alive = monitored.heartbeat_alive(datetime.utcnow())
+            self.tracker.observe(monitored.guild_id, monitored.bot_id, alive, source='probe')
+        elif monitored.key not in self.probes:
+            self.schedule_probe(monitored, jitter=True)
+
+    async def receive_heartbeat(self, token):
+        result = await self.db.record_heartbeat(token)
+        if result is None:
+            return False
+        monitored = self.tracker.get(*result)
+        if monitored is not None:
+            monitored.last_heartbeat = time.time()
+            self.heartbeats.set(monitored.key, monitored.heartbeat_deadline())
+            self.tracker.observe(monitored.guild_id, monitored.bot_id, True, source='probe')
+        return True
+
+    async def sync_guilds(self, guilds):
+        rows, subscriptions = await asyncio.gather(self.db.get_monitored_bots(guilds.keys()),
+                                                   self.db.get_subscriptions(guilds.keys()))
+        self.subscriptions.replace_guilds(guilds.keys(), subscriptions)
+        members = await self.load_monitored_members(guilds, rows)
+        registered = set()
+        for row in rows:
+            registered.add((row['guild_id'], row['bot_id']))
+            # 1件の不正な行や通知の失敗で残りのBOTの同期が止まらないようにする
+            try:
+                self.sync_bot(row, members.get((row['guild_id'], row['bot_id'])))
+            except Exception as e:
+                logger.exception("BOTの同期に失敗しました: %s %s", row['bot_id'], e)
+        for key in list(self.tracker.bots):
+            if key[0] in guilds and key not in registered:
+                self.untrack(*key)
+                self.registry.unregister(*key)
+        return rows
+
+    def sync_bot(self, row, bot_member):
+        loaded = MonitoredBot.from_row(row)
+        if loaded.key not in self.tracker.bots:
+            self.snapshot.restore(loaded)
+        monitored = self.tracker.track(loaded)
+        if monitored is loaded:
+            self.states.remember(monitored)
+            # まとめて追加したBOTや履歴の記録前から登録されているBOTは、状態が変わるまで稼働率を集計できないため起点を記録する
+            if not row.get('has_history'):
+                self.events.append((monitored.guild_id, monitored.bot_id, monitored.online, datetime.utcnow()))
+        monitored.refresh(row)
+        self.registry.register(row['guild_id'], row['bot_id'], row['user_id'], row['name'])
+        if monitored.key not in self.checks:
+            self.schedule_check(monitored, jitter=True)
+        self.apply_probe(monitored)
+        if bot_member is not None:
+            self.tracker.observe(row['guild_id'], bot_member.id, is_up(bot_member))
+
+    async def load_monitored_members(self, guilds, rows):
+        # 低メモリモードでは監視対象のBOTを持つギルドだけ、そのBOTのメンバー情報を取得してキャッシュする
+        bot_ids = {}
+        for row in rows:
+            bot_ids.setdefault(row['guild_id'], []).append(row['bot_id'])
+        presences = self.bot.intents.presences
+        results = await asyncio.gather(*(load_members(guilds[guild_id], ids, presences=presences, cache=True)
+                                         for guild_id, ids in bot_ids.items()), return_exceptions=True)
+        members = {}
+        for guild_id, result in zip(bot_ids, results):
+            if isinstance(result, BaseException):
+                logger.warning("メンバーの取得に失敗しました: %s %s", guild_id, result)
+                continue
+            members.update(((guild_id, user_id), member) for user_id, member in result.items())
+        return members
+
+    @tasks.loop(minutes=10)
     async def check_bots(self):
-        logging.debug('Checking bots...')
+        # 通常の検知は on_presence_update とBOTごとのスケジュールで行い、ここでは取りこぼしの補正と登録内容の同期のみを行う
+        logger.debug('Reconciling bots...')
+        # リースを保持しているシャードのギルドだけを評価する
+        guilds = {guild.id: guild for guild in self.bot.guilds if self.leases.owns(guild.shard_id)}
+        with SWEEP_SECONDS.time():
+            try:
+                await self.sync_guilds(guilds)
+            except Exception as e:
+                logger.exception("Error: %s", e)
+                return
+            for key in list(self.tracker.bots):
+                if key[0] not in guilds:
+                    self.untrack(*key)
+            self.presence_ready.update(shard_id for shard_id in self.bot.shards if self.leases.owns(shard_id))
+            await self.flush_states()
+        self.update_population()
+        SWEEP_BOTS.set(len(self.tracker))
+        logger.debug("監視中のBOT: %d", len(self.tracker))
+
+    @check_bots.before_loop
+    async def before_check_bots(self):
+        await self.leases_ready.wait()
+        if self.check_runner is None:
+            self.check_runner = asyncio.create_task(self.checks.run(self.evaluate))
+
+    @tasks.loop(minutes=5)
+    async def roll_up_history(self):
+        until = datetime.utcnow()
+        try:
+            rolled_until = await self.history.roll_up(until)
+            while rolled_until is not None and rolled_until < floor_hour(until):
+                rolled_until = await self.history.roll_up(until)
+            await self.db.purge_notifications(until - timedelta(days=1))
+        except Exception as e:
+            logger.exception("Error: %s", e)
+
+    @roll_up_history.before_loop
+    async def before_roll_up_history(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=30)
+    async def check_heartbeats(self):
+        # ハートビートは他のワーカーが受信している場合もあるため、データベースから最新の受信時刻を読み込む
+        guild_ids = {guild_id for guild_id, _ in self.tracker.bots}
+        if not guild_ids:
+            return
         try:
-            for guild in self.bot.guilds:
-                bots = self.db.get_bots(guild.id)
-                logging.debug(f"サーバー: {guild.name}, BOTリスト: {bots}")
-                for bot in bots:
-                    bot_id = bot[2]
-                    user_id = self.db.find_user_by_bot_id(bot_id)
-                    logging.debug(f"BOT ID: {bot_id}, ユーザーID: {user_id}")
-                    if user_id is None:
-                        logging.debug(f"ユーザーが見つかりません: BOT ID {bot[0]}")
-                        continue
-
-                    bot_data = self.db.get_bot_data(bot_id)
-                    logging.debug(f"BOTデータ: {bot_data}")
-                    if not bot_data:
-                        logging.debug(f"BOT: {bot_data['name']} が見つかりません。")
-                        continue
-
-                    bot_member = guild.get_member(bot_data['bot_id'])
-                    logging.debug(f"BOTー: {bot_member}")
-                    if not bot_member:
-                        continue
-
-                    last_online = bot_data['last_online']
-                    logging.debug(f"BOTオンライン: {last_online}")
-                    notification_channel = self.db.get_notification_channel(bot_id)
-                    logging.debug(f"通知チャンネル: {notification_channel}")
-
-                    if bot_member.status != discord.Status.online:
-                        logging.debug(f"BOT: {bot_member.name}")
-                        logging.debug(f"BOT: {bot_member.status}")
-                        logging.debug(f"最終オンライン: {last_online}")
-                        last_notified = bot_data.get('last_notification_time')
-                        if last_notified is not None:
-                            if isinstance(last_notified, str):
-                                last_notified = datetime.fromisoformat(last_notified)
-                            logging.debug(f"最終通知: {last_notified}")
-                        else:
-                            last_notified = datetime.utcnow() - timedelta(minutes=11)
-                            logging.debug(f"最終通知: {last_notified}")
-
-                        if datetime.utcnow() - last_notified > timedelta(minutes=10):
-                            logging.debug(f"{bot_member.name}がオフラインになって10分が経過しました。")
-                            if notification_channel:
-                                logging.debug(f"通知チャンネル: {notification_channel.name}")
-                                now_jst = datetime.now(timezone(timedelta(hours=9)))
-                                e = discord.Embed(title='BOTがオフラインになりました。', description=f"{bot_member.name}がオフラインになって10分が経過しました。", color=discord.Color.red(), timestamp=now_jst)
-                                last_online_time = last_online
-                                last_online_timestamp = last_online_time.timestamp()
-                                e.add_field(name='BOT情報', value=f"ID: {bot_member.id}\n名前: {bot_member.name}\nオフライン時間: <t:{int(last_online_timestamp)}:F> | <t:{int(last_online_timestamp)}:R>")
-                                await notification_channel.send(embed=e)
-                                self.db.update_last_channel_notification_time(bot_member.id, datetime.utcnow().isoformat())
-                                logging.debug(f"{bot_member.name}にチャンネル通知を送信しました。")
-                                self.db.reset_last_notification_time(bot_member.id)  # オンライン通知時間をリセット
-                            else:
-                                logging.debug("知チンネルが見つかりません。")
-                            if user_id is not None:
-                                user = self.bot.get_user(int(user_id))
-                                if user:
-                                    dm_channel = user.dm_channel or await user.create_dm()
-                                    now_jst = datetime.now(timezone(timedelta(hours=9)))
-                                    e = discord.Embed(title='BOTがオフラインになりました。', description=f"{bot_member.name}がオフラインになって10分が経過しました。", color=discord.Color.red(), timestamp=now_jst)
-                                    last_online_time = last_online
-                                    last_online_timestamp = last_online_time.timestamp()
-                                    e.add_field(name='BOT情報', value=f"ID: {bot_member.id}\n名前: {bot_member.name}\nオフライン時間: <t:{int(last_online_timestamp)}:F> | <t:{int(last_online_timestamp)}:R>")
-                                    await dm_channel.send(embed=e)
-                                    self.db.update_last_dm_notification_time(bot_member.id, datetime.utcnow().isoformat())
-                                    logging.debug(f"{bot_member.name}にDMを送信しました。")
-                                else:
-                                    logging.error("ユーザーが見つかりません。")
-                            self.db.update_last_notification_time(bot_member.id, datetime.utcnow().isoformat(), 'last_notification_time')
-                            self.db.update_last_channel_online_notification_time(bot_member.id, None)
-                            self.db.update_last_dm_online_notification_time(bot_member.id, None)
-                            logging.debug(f"{bot_member.name}の通知時間を更新しました。")
-                        else:
-                            logging.debug(f"{bot_member.name}に通知を送信済みです。")
-                    else:
-                        nokori = timedelta(minutes=10) - (datetime.utcnow() - last_online)
-                        if nokori.total_seconds() > 0:
-                            logging.debug(f"{bot_member.name}がオフラインになって10分未満です。:あと{nokori}")
-                        else:
-                            logging.debug(f"{bot_member.name}がオフラインになって10分未満です。")
-
-                    if bot_member.status == discord.Status.online:
-                        logging.debug(f"BOT: {bot_member.name}")
-                        now_jst = datetime.now(timezone(timedelta(hours=9)))
-                        last_online_time = last_online
-                        last_online_timestamp = last_online_time.timestamp()
-                        e = discord.Embed(title='BOTがオンラインになりました。', description=f"{bot_member.name}がオンラインになりました。", color=discord.Color.green(), timestamp=now_jst)
-                        e.add_field(name='BOT情報', value=f"ID: {bot_member.id}\n名前: {bot_member.name}\nオンライン時間: <t:{int(last_online_timestamp)}:F> | <t:{int(last_online_timestamp)}:R>")
-                        
-                        last_channel_online_notification_time = bot_data.get('last_channel_online_notification_time', '1970-01-01T00:00:00')
-                        if last_channel_online_notification_time is None:
-                            if notification_channel:
-                                notification_ch = self.bot.get_channel(notification_channel)
-                                await notification_ch.send(embed=e)
-                                self.db.update_last_channel_online_notification_time(bot_member.id, datetime.utcnow().isoformat())
-                                logging.debug(f"{bot_member.name}にチャンネル通知を送信しました。")
-                            else:
-                                logging.debug("通知チャンネルが見つかりません。")
-                        else:
-                            logging.debug(f"{bot_member.name}に通知を送信済みです。")
-                        
-                        last_dm_time_str = bot_data.get('last_dm_online_notification_time', '1970-01-01T00:00:00')
-                        if last_dm_time_str is None:
-                            if user_id is not None:
-                                user = self.bot.get_user(int(user_id))
-                                if user:
-                                    dm_channel = user.dm_channel or await user.create_dm()
-                                    await dm_channel.send(embed=e)
-                                    self.db.update_last_dm_online_notification_time(bot_member.id, datetime.utcnow().isoformat())
-                                    logging.debug(f"{bot_member.name}にDMを送信しました。")
-                                else:
-                                    logging.error("ユーザーが見つかりません。")
-                            else:
-                                logging.error("ユーザーが見つかりません。")
-                        else:
-                            logging.debug(f"{bot_member.name}に通知を送信済みです。")
-                        
-                        bot_data['last_online'] = datetime.utcnow()
-                        self.db.update_bot(bot_member.id, last_online=datetime.utcnow())
-                        logging.debug(f"{bot_member.name}のオンライン時間を更新しました。")
-                        last_notified = bot_data.get('last_notification_time', None)
-                        logging.debug(f"最終通知: {last_notified}")
-                        if last_notified is not None:
-                            self.db.reset_last_notification_time(bot_member.id)
-                            logging.debug(f"{bot_member.name}のオンライン時間と通知時間を更新しました。")
-                        else:
-                            logging.debug(f"{bot_member.name}のオンライン時間を更新しました。")
+            rows = await self.db.get_heartbeats(guild_ids)
         except Exception as e:
-            err_traceback = traceback.format_exc()
-            logging.error(f"Error: {e}")
-            logging.error(f"Error traceback: {err_traceback}")
-            pass 
+            logger.exception("Error: %s", e)
+            return
+        for row in rows:
+            monitored = self.tracker.get(row['guild_id'], row['bot_id'])
+            if monitored is None or monitored.probe_kind != 'heartbeat':
+                continue
+            monitored.last_heartbeat = to_epoch(row['last_heartbeat'])
+            self.heartbeats.set(monitored.key, monitored.heartbeat_deadline())
+        # 期限の比較は列全体に対してまとめて行い、状態が変わったBOTだけを判定し直す
+        for (guild_id, bot_id), alive in self.heartbeats.changed(time.time()):
+            self.tracker.observe(guild_id, bot_id, alive, source='probe')
+
+    @check_heartbeats.before_loop
+    async def before_check_heartbeats(self):
+        await self.leases_ready.wait()
+
+    @tasks.loop(seconds=30)
+    async def watch_incidents(self):
+        for incident in self.correlator.expire(datetime.utcnow()):
+            await self.notify_incident(incident, resolved=True)
+
+    @watch_incidents.before_loop
+    async def before_watch_incidents(self):
+        await self.bot.wait_until_ready()
+
+def subscription_target(interaction: discord.Interaction, channel, webhook):
+    if webhook:
+        return 'webhook', webhook
+    if channel is not None:
+        return 'channel', channel.id
+    return 'user', interaction.user.id
+
+def is_up(member: discord.Member):
+    # 退席中や取り込み中もゲートウェイには接続しているため稼働中として扱う
+    return member.status is not discord.Status.offline
+
+def snapshot_path(bot):
+    # 担当するシャードが異なるワーカー同士でファイルを共有しないよう、シャードIDをファイル名に含める
+    path = os.getenv('SNAPSHOT_PATH')
+    if path:
+        return path
+    shard_ids = getattr(bot, 'shard_ids', None)
+    if shard_ids:
+        return f"data/snapshot-{'-'.join(map(str, sorted(shard_ids)))}.json"
+    return 'data/snapshot.json'
 
 async def setup(bot):
     db_setup = DatabaseSetup()
-    if db_setup.db_connection is None:
-        logging.error("データベースへの接続に失敗しました。")
+    if await db_setup.connect() is None:
         return
-    db_setup.create_tables()
+    await db_setup.create_tables()
     await bot.add_cog(HealthCheckGroup(bot, db_setup.db))
\ No newline at end of file
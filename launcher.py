@@ -0,0 +1,55 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# シャードを複数のワーカープロセスに分割して起動する
+shard_count = int(os.getenv('SHARD_COUNT', '1'))
+workers = max(1, min(int(os.getenv('WORKERS', str(os.cpu_count() or 1))), shard_count))
+
+
+def shard_ranges(shard_count, workers):
+    per_worker, remainder = divmod(shard_count, workers)
+    start = 0
+    for i in range(workers):
+        end = start + per_worker + (1 if i < remainder else 0)
+        yield start, end - 1
+        start = end
+
+
+def spawn(index, first, last):
+    env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=f"{first}-{last}", WORKER_ID=f"worker-{index}")
+    print(f"ワーカー{index}を起動します: シャード {first}-{last}")
+    return subprocess.Popen([sys.executable, 'main.py'], env=env)
+
+
+def main():
+    ranges = list(shard_ranges(shard_count, workers))
+    processes = [spawn(i, first, last) for i, (first, last) in enumerate(ranges)]
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while not stopping:
+        for i, process in enumerate(processes):
+            if process.poll() is not None and not stopping:
+                print(f"ワーカー{i}が終了しました (code={process.returncode})。再起動します。")
+                processes[i] = spawn(i, *ranges[i])
+        time.sleep(5)
+    for process in processes:
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,15 +4,18 @@ from discord.ext import commands
 from dotenv import load_dotenv
 import os
 import re
-import pathlib
 from datetime import datetime
 import logging
 import traceback
 import sys
 import asyncio
 
+from utils import api
 from utils import presence
-from utils.logging import save_log
+from utils import metrics
+from utils.extensions import manifest, sync_tree_if_changed
+from utils.sharding import parse_shard_ids
+from utils.logging import save_log, setup_logging
 from utils import error
 
 load_dotenv()
@@ -32,7 +35,7 @@ logger = logging.getLogger('discord.gateway')
 logger.setLevel(logging.INFO)
 logger.addHandler(SessionIDHandler())
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
 TOKEN = os.getenv('BOT_TOKEN')
 command_prefix = ['hc/']
@@ -43,6 +46,7 @@ class MyBot(commands.AutoShardedBot):
         super().__init__(*args, **kwargs)
         self.initialized = False
         self.cog_classes = {}
+        self.failed_cogs = {}
 
     async def logo(self):
         logging.info("-" * 15)
@@ -59,14 +63,27 @@ class MyBot(commands.AutoShardedBot):
         logging.info("Python: v%s", '.'.join(map(str, sys.version_info[:3])))
 
     async def setup_hook(self):
+        metrics_port = os.getenv('METRICS_PORT')
+        if metrics_port:
+            metrics.GATEWAY_LATENCY_SECONDS.set_function(lambda: {(str(shard_id),): latency for shard_id, latency in self.latencies})
+            await metrics.start_server(int(metrics_port), os.getenv('METRICS_HOST', '127.0.0.1'))
+            self.loop.create_task(metrics.monitor_loop_lag())
+        api.sampler.start(self)
+        # ログイン後・ゲートウェイ接続前に拡張機能を並行して読み込み、コマンドツリーは変更があった場合だけ同期する
+        await self.load_cogs()
+        await sync_tree_if_changed(self)
         self.loop.create_task(self.after_ready())
 
+    async def close(self):
+        api.sampler.stop()
+        # cog の終了処理が API を使う場合があるため、セッションは最後に閉じる
+        await super().close()
+        await api.http.close()
+
     async def after_ready(self):
         await self.wait_until_ready()
         print("setup_hook is called")
         await self.change_presence(activity=discord.Game(name="起動中.."))
-        await self.load_cogs('cogs')
-        await self.tree.sync()
         if not self.initialized:
             print("Initializing...")
             self.initialized = True
@@ -92,24 +109,43 @@ class MyBot(commands.AutoShardedBot):
                 print(f"Error during startup: {e}")
             self.initialized = True
 
-    async def load_cogs(self, folder_name: str):
-        cur = pathlib.Path('.')
-        for p in cur.glob(f"{folder_name}/**/*.py"):
-            if p.stem == "__init__" or "backup" in p.parts:
-                continue
-            try:
-                cog_path = p.relative_to(cur).with_suffix('').as_posix().replace('/', '.')
-                await self.load_extension(cog_path)
-                print(f'{cog_path} loaded successfully.')
-            except commands.ExtensionFailed as e:
-                traceback.print_exc()
-                print(f'Failed to load extension {p.stem}: {e}\nFull error: {e.__cause__}')
+    async def load_cogs(self):
+        modules = manifest.modules()
+        results = await asyncio.gather(*(self.load_extension(module) for module in modules), return_exceptions=True)
+        for module, result in zip(modules, results):
+            if isinstance(result, BaseException):
+                self.failed_cogs[module] = result
+                traceback.print_exception(type(result), result, result.__traceback__)
+                print(f'Failed to load extension {module}: {result}\nFull error: {result.__cause__}')
+            else:
+                self.failed_cogs.pop(module, None)
+                print(f'{module} loaded successfully.')
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, exc):
         await error.send_error_message(ctx, exc)
 
-intent: discord.Intents = discord.Intents.all()
-bot = MyBot(command_prefix=command_prefix, intents=intent, help_command=None)
-bot.run(TOKEN)
-bot.run(TOKEN)
\ No newline at end of file
+# launcher.py から起動された場合は担当するシャードだけに接続する
+shard_ids = parse_shard_ids(os.getenv('SHARD_IDS'))
+shard_count = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+
+def low_memory_options():
+    """監視に必要なインテントだけを有効にし、メンバーは監視対象のBOTだけをキャッシュします
+
+    起動時のメンバー一覧の取得(チャンク)は行わず、監視対象のBOTがいるギルドだけ必要なメンバーを取得するため、
+    メモリ使用量はサーバーの参加人数ではなく監視中のBOTの数に比例します。
+    """
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.members = True
+    intents.presences = True
+    intents.guild_messages = True
+    intents.message_content = True
+    return {'intents': intents, 'member_cache_flags': discord.MemberCacheFlags.none(), 'chunk_guilds_at_startup': False}
+
+if os.getenv('LOW_MEMORY', '').lower() in ('1', 'true', 'yes'):
+    options = low_memory_options()
+else:
+    options = {'intents': discord.Intents.all()}
+bot = MyBot(command_prefix=command_prefix, help_command=None, shard_ids=shard_ids, shard_count=shard_count, **options)
+bot.run(TOKEN, log_handler=None)
\ No newline at end of file
@@ -1,13 +1,118 @@
 import aiohttp
+import asyncio
+import math
+import random
 import time
+from collections import deque
+
+GATEWAY_URL = 'https://discord.com/api/v9/gateway'
+
+
+class HttpClient:
+    """プロセス全体で共有するaiohttpセッション。接続をキープアライブで再利用します"""
+
+    def __init__(self, limit=100, limit_per_host=20, timeout=10, resolver=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.resolver = resolver
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             ttl_dns_cache=300, keepalive_timeout=60, resolver=self.resolver)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class LatencyWindow:
+    def __init__(self, size=120):
+        self.samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+    def percentiles(self):
+        return {p: self.percentile(p) for p in (50, 95, 99)}
+
+
+class LatencySampler:
+    """REST APIとゲートウェイのレイテンシを定期的に計測し、直近の値を保持します
+
+    /ping はこの値から即座に応答し、ヘルスチェックはDiscord側の劣化中に通知を保留する判断に使います。
+    """
+
+    def __init__(self, interval=30, window=120, degraded_p95=1500, degraded_failures=0.5):
+        self.interval = interval
+        self.rest = LatencyWindow(window)
+        self.gateway = LatencyWindow(window)
+        self.results = deque(maxlen=10)
+        self.degraded_p95 = degraded_p95
+        self.degraded_failures = degraded_failures
+        self.bot = None
+        self._task = None
+
+    def start(self, bot):
+        self.bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def sample(self):
+        rest_ping = await measure_api_ping()
+        self.results.append(rest_ping is not None)
+        if rest_ping is not None:
+            self.rest.add(rest_ping)
+        if self.bot is not None and math.isfinite(self.bot.latency):
+            self.gateway.add(self.bot.latency * 1000)
+        return rest_ping
+
+    def is_degraded(self):
+        if self.results and self.results.count(False) / len(self.results) >= self.degraded_failures:
+            return True
+        recent = LatencyWindow(10)
+        for value in list(self.rest.samples)[-10:]:
+            recent.add(value)
+        p95 = recent.percentile(95)
+        return p95 is not None and p95 >= self.degraded_p95
+
+    async def _run(self):
+        while True:
+            await self.sample()
+            await asyncio.sleep(self.interval + random.uniform(0, self.interval / 10))
+
+
+http = HttpClient()
+sampler = LatencySampler()
+
 
 async def measure_api_ping():
-    url = 'https://discord.com/api/v9/gateway'
-    async with aiohttp.ClientSession() as session:
+    try:
         start_time = time.monotonic()
-        async with session.get(url) as resp:
+        async with http.session.get(GATEWAY_URL) as resp:
+            await resp.read()
             if resp.status == 200:
                 end_time = time.monotonic()
                 return (end_time - start_time) * 1000
             else:
-                return None
\ No newline at end of file
+                return None
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
@@ -0,0 +1,80 @@
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# これより少ない件数では numpy の配列を作るコストの方が大きい
+VECTORIZE_THRESHOLD = 512
+
+
+class DeadlineColumns:
+    """キーごとの期限(エポック秒)を array('d') の列で保持し、期限切れの判定をまとめて行います
+
+    MonitoredBot を1件ずつ辿らずに連続したメモリ上で比較するため、numpy があればベクトル演算で、
+    なければ配列を1回走査して判定します。削除した枠は再利用します。
+    列自体は1件あたり9バイトですが、キーから枠への辞書とキーのリストを合わせると1件あたり約100バイト
+    (キーのタプル自体は MonitoredBot などと共有)になります。
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.keys = []
+        self.deadlines = array('d')
+        # 前回の判定結果。1=期限内, 0=期限切れ, -1=未判定
+        self.alive = array('b')
+        self._free = []
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def set(self, key, deadline):
+        slot = self.index.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self.keys[slot] = key
+            else:
+                slot = len(self.keys)
+                self.keys.append(key)
+                self.deadlines.append(math.nan)
+                self.alive.append(-1)
+            self.index[key] = slot
+        self.deadlines[slot] = deadline
+
+    def remove(self, key):
+        slot = self.index.pop(key, None)
+        if slot is None:
+            return
+        self.keys[slot] = None
+        self.deadlines[slot] = math.nan
+        self.alive[slot] = -1
+        self._free.append(slot)
+
+    def changed(self, now):
+        """前回の判定から期限内/期限切れが変わったキーを (key, alive) のリストで返します"""
+        if numpy is not None and len(self.keys) >= VECTORIZE_THRESHOLD:
+            return self._changed_vectorized(now)
+        changes = []
+        for slot, deadline in enumerate(self.deadlines):
+            # 空き枠は NaN のため比較は常に偽になり、alive は -1 のまま
+            if deadline != deadline:
+                continue
+            alive = 1 if now <= deadline else 0
+            if alive != self.alive[slot]:
+                self.alive[slot] = alive
+                changes.append((self.keys[slot], bool(alive)))
+        return changes
+
+    def _changed_vectorized(self, now):
+        deadlines = numpy.frombuffer(self.deadlines, dtype=numpy.float64)
+        previous = numpy.frombuffer(self.alive, dtype=numpy.int8)
+        alive = (now <= deadlines).astype(numpy.int8)
+        slots = numpy.flatnonzero(~numpy.isnan(deadlines) & (alive != previous))
+        previous[slots] = alive[slots]
+        return [(self.keys[slot], bool(alive[slot])) for slot in slots.tolist()]
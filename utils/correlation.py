@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from datetime import timedelta
+
+GLOBAL = 'global'
+
+
+class Incident:
+    def __init__(self, scope, started_at):
+        self.scope = scope
+        self.started_at = started_at
+        self.last_seen = started_at
+        self.affected = set()
+
+
+class OutageCorrelator:
+    """短時間に多数の監視対象BOTがオフラインになった状況をシャード/全体単位の障害として検出します
+
+    window 内にオフラインになったBOTの割合が threshold 以上かつ min_bots 件以上になると
+    障害として扱い、その間は個別の通知を保留します。cooldown の間しきい値を下回り続けると解除します。
+    """
+
+    def __init__(self, window=timedelta(minutes=2), threshold=0.3, min_bots=5, cooldown=timedelta(minutes=5)):
+        self.window = window
+        self.threshold = threshold
+        self.min_bots = min_bots
+        self.cooldown = cooldown
+        self.population = {GLOBAL: 0}
+        self.recent = {}
+        self.incidents = {}
+
+    def set_population(self, total, per_shard):
+        self.population = dict(per_shard)
+        self.population[GLOBAL] = total
+
+    def record(self, key, shard_id, online, now):
+        """オフラインへの遷移を記録し、新たに始まった障害のリストを返します"""
+        if online:
+            for recent in self.recent.values():
+                recent.pop(key, None)
+            return []
+        started = []
+        for scope in (GLOBAL, shard_id):
+            recent = self.recent.setdefault(scope, OrderedDict())
+            recent.pop(key, None)
+            recent[key] = now
+            self._prune(recent, now)
+            incident = self.incidents.get(scope)
+            if incident is not None:
+                incident.affected.add(key)
+            if self._exceeds(scope, len(recent)):
+                if incident is None:
+                    incident = self.incidents[scope] = Incident(scope, now)
+                    incident.affected.update(recent)
+                    started.append(incident)
+                incident.last_seen = now
+        return started
+
+    def is_suppressed(self, shard_id):
+        return GLOBAL in self.incidents or shard_id in self.incidents
+
+    def expire(self, now):
+        """cooldown を過ぎた障害を解除し、そのリストを返します"""
+        ended = []
+        for scope, incident in list(self.incidents.items()):
+            recent = self.recent.get(scope, {})
+            self._prune(recent, now)
+            if self._exceeds(scope, len(recent)):
+                incident.last_seen = now
+            elif now - incident.last_seen >= self.cooldown:
+                ended.append(self.incidents.pop(scope))
+        return ended
+
+    def _exceeds(self, scope, count):
+        population = self.population.get(scope, 0)
+        return count >= self.min_bots and population > 0 and count / population >= self.threshold
+
+    def _prune(self, recent, now):
+        while recent:
+            key, at = next(iter(recent.items()))
+            if now - at <= self.window:
+                break
+            recent.popitem(last=False)
@@ -1,36 +1,129 @@
 import psycopg2
+import asyncio
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 class Database:
-    def __init__(self):
-        self.dsn = os.getenv('DATABASE_URL')
-        self.conn = None
+    """スレッドプール上でpsycopg2を実行する非同期コネクションプール
 
-    def connect(self):
+    connect には psycopg2.connect 互換の関数を渡せるため、ローカルのPostgresや
+    インプロセスのスタンドインに差し替えてテストできます。
+    一定時間使われていない接続は取り出す前に疎通を確認し、切断されていれば作り直します。
+    クエリの送信後に起きたエラーは、書き込みが反映されたか分からないため再試行せずに送出します。
+    """
+
+    def __init__(self, dsn=None, min_size=1, max_size=10, connect=None, retries=1, ping_after=30):
+        self.dsn = dsn or os.getenv('DATABASE_URL')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.retries = retries
+        self.ping_after = ping_after
+        self._connect = connect or psycopg2.connect
+        self._idle = []
+        self._busy = set()
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix='db')
+
+    async def connect(self):
         try:
-            self.conn = psycopg2.connect(self.dsn)
+            for _ in range(self.min_size):
+                self._idle.append((await self._in_thread(self._connect, self.dsn), time.monotonic()))
             logging.debug("データベースに接続しました。")
-            return self.conn
+            return self
         except Exception as e:
-            logging.error(f"データベース接続に失敗しました: {e}")
+            logging.error("データベース接続に失敗しました: %s", e)
             return None
 
-    def close(self):
-        if self.conn:
-            self.conn.close()
-            logging.debug("データベース接続を閉じました。")
-        
-    def commit(self):
-        self.conn.commit()
-        logging.debug("データベースに変更をコミットしました。")
-
-    def execute(self, query, params=None, commit=False, cursor_factory=None):
-        with self.conn.cursor(cursor_factory=cursor_factory) as cursor:
-            cursor.execute(query, params)
-            if commit:
-                self.conn.commit()
-            if cursor.description:
-                return cursor.fetchall()
-            return None
+    async def close(self):
+        while self._idle:
+            self._discard(self._idle.pop()[0])
+        # 実行中のクエリがある接続も閉じる
+        while self._busy:
+            self._discard(self._busy.pop())
+        self._executor.shutdown(wait=False)
+        logging.debug("データベース接続を閉じました。")
+
+    async def run(self, fn, *args, commit=True):
+        """プールから取得した接続で fn(conn, *args) をワーカースレッド上で実行します"""
+        async with self._semaphore:
+            conn = await self._acquire()
+            self._busy.add(conn)
+            try:
+                result = await self._in_thread(self._call, conn, fn, args, commit)
+            finally:
+                self._busy.discard(conn)
+                # クエリのキャンセルやデッドロックなどでは接続は使えるため、切断された場合だけ破棄する
+                if getattr(conn, 'closed', False):
+                    self._discard(conn)
+                else:
+                    self._release(conn)
+            return result
+
+    async def execute(self, query, params=None, commit=False, cursor_factory=None):
+        def _execute(conn):
+            kwargs = {'cursor_factory': cursor_factory} if cursor_factory else {}
+            with conn.cursor(**kwargs) as cursor:
+                cursor.execute(query, params)
+                if cursor.description:
+                    return cursor.fetchall()
+                return None
+        return await self.run(_execute, commit=commit)
+
+    async def _in_thread(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
 
+    async def _acquire(self):
+        # クエリを送る前に切断を検知できた場合だけ、別の接続で再試行する
+        attempts = 0
+        while self._idle:
+            conn, released_at = self._idle.pop()
+            if getattr(conn, 'closed', False):
+                continue
+            if time.monotonic() - released_at < self.ping_after:
+                return conn
+            try:
+                await self._in_thread(self._ping, conn)
+                return conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self._discard(conn)
+                attempts += 1
+                logging.warning("データベース接続が切断されていました。再接続します: %s", e)
+                if attempts > self.retries:
+                    break
+        return await self._in_thread(self._connect, self.dsn)
+
+    def _release(self, conn):
+        self._idle.append((conn, time.monotonic()))
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _ping(conn):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        conn.rollback()
+
+    @staticmethod
+    def _call(conn, fn, args, commit):
+        # 読み取りのみの場合もロールバックしてトランザクションを閉じ、接続をアイドル状態で返却する
+        try:
+            result = fn(conn, *args)
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception:
+            if not getattr(conn, 'closed', False):
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        return result
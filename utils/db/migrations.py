@@ -0,0 +1,213 @@
+import logging
+
+# 複数プロセスが同時に起動してもマイグレーションが一度だけ実行されるようにするためのロックID
+MIGRATION_LOCK_ID = 72_173_001
+
+MIGRATIONS = [
+    (1, 'create bots and channels', """
+    CREATE TABLE IF NOT EXISTS bots (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        name TEXT NOT NULL,
+        last_online TIMESTAMP,
+        last_notification_time TIMESTAMP,
+        last_channel_notification_time TIMESTAMP,
+        last_dm_notification_time TIMESTAMP,
+        last_channel_online_notification_time TIMESTAMP,
+        last_dm_online_notification_time TIMESTAMP,
+        guild_id BIGINT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS channels (
+        id SERIAL PRIMARY KEY,
+        channel_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        name TEXT NOT NULL,
+        last_online TIMESTAMP,
+        last_notification_time TIMESTAMP,
+        last_channel_notification_time TIMESTAMP,
+        last_dm_notification_time TIMESTAMP,
+        last_channel_online_notification_time TIMESTAMP,
+        last_dm_online_notification_time TIMESTAMP
+    );
+    """),
+    (2, 'unique keys and lookup indexes', """
+    DELETE FROM bots a USING bots b
+    WHERE a.guild_id = b.guild_id AND a.bot_id = b.bot_id AND a.id > b.id;
+    DELETE FROM channels a USING channels b
+    WHERE a.bot_id = b.bot_id AND a.channel_id = b.channel_id AND a.id > b.id;
+    ALTER TABLE bots ADD CONSTRAINT bots_guild_id_bot_id_key UNIQUE (guild_id, bot_id);
+    ALTER TABLE channels ADD CONSTRAINT channels_bot_id_channel_id_key UNIQUE (bot_id, channel_id);
+    CREATE INDEX bots_bot_id_idx ON bots (bot_id);
+    CREATE INDEX bots_user_id_guild_id_idx ON bots (user_id, guild_id);
+    """),
+    (3, 'notification state table', """
+    CREATE TABLE notification_state (
+        guild_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        last_notification_time TIMESTAMP,
+        last_dm_notification_time TIMESTAMP,
+        last_dm_online_notification_time TIMESTAMP,
+        last_channel_notification_time TIMESTAMP,
+        last_channel_online_notification_time TIMESTAMP,
+        PRIMARY KEY (guild_id, bot_id),
+        FOREIGN KEY (guild_id, bot_id) REFERENCES bots (guild_id, bot_id) ON DELETE CASCADE
+    );
+    INSERT INTO notification_state (
+        guild_id, bot_id, last_notification_time, last_dm_notification_time,
+        last_dm_online_notification_time, last_channel_notification_time,
+        last_channel_online_notification_time
+    )
+    SELECT b.guild_id, b.bot_id, b.last_notification_time, b.last_dm_notification_time,
+           b.last_dm_online_notification_time, c.last_channel_notification_time,
+           c.last_channel_online_notification_time
+    FROM bots b
+    LEFT JOIN LATERAL (
+        SELECT * FROM channels WHERE channels.bot_id = b.bot_id ORDER BY channels.id LIMIT 1
+    ) c ON TRUE;
+    ALTER TABLE bots
+        DROP COLUMN last_notification_time,
+        DROP COLUMN last_channel_notification_time,
+        DROP COLUMN last_dm_notification_time,
+        DROP COLUMN last_channel_online_notification_time,
+        DROP COLUMN last_dm_online_notification_time;
+    ALTER TABLE channels
+        DROP COLUMN last_online,
+        DROP COLUMN last_notification_time,
+        DROP COLUMN last_channel_notification_time,
+        DROP COLUMN last_dm_notification_time,
+        DROP COLUMN last_channel_online_notification_time,
+        DROP COLUMN last_dm_online_notification_time;
+    """),
+    (4, 'status event log and uptime rollups', """
+    CREATE TABLE bot_status_events (
+        id BIGSERIAL PRIMARY KEY,
+        guild_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        online BOOLEAN NOT NULL,
+        occurred_at TIMESTAMP NOT NULL
+    );
+    CREATE INDEX bot_status_events_occurred_at_idx ON bot_status_events (occurred_at);
+    CREATE INDEX bot_status_events_bot_idx ON bot_status_events (guild_id, bot_id, occurred_at);
+    CREATE TABLE bot_uptime_rollups (
+        guild_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        granularity TEXT NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        online_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+        offline_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+        outages INTEGER NOT NULL DEFAULT 0,
+        recoveries INTEGER NOT NULL DEFAULT 0,
+        repair_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, bot_id, granularity, bucket)
+    );
+    CREATE TABLE rollup_watermark (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        rolled_until TIMESTAMP NOT NULL
+    );
+    """),
+    (5, 'shard leases', """
+    CREATE TABLE shard_leases (
+        shard_id INTEGER PRIMARY KEY,
+        worker_id TEXT NOT NULL,
+        expires_at TIMESTAMPTZ NOT NULL
+    );
+    """),
+    (6, 'per-bot and per-guild check settings', """
+    ALTER TABLE bots
+        ADD COLUMN grace_seconds INTEGER,
+        ADD COLUMN check_interval_seconds INTEGER,
+        ADD COLUMN renotify_seconds INTEGER;
+    CREATE TABLE guild_settings (
+        guild_id BIGINT PRIMARY KEY,
+        grace_seconds INTEGER,
+        check_interval_seconds INTEGER,
+        renotify_seconds INTEGER
+    );
+    """),
+    (7, 'http and heartbeat probes', """
+    CREATE TABLE bot_probes (
+        guild_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('http', 'heartbeat')),
+        url TEXT,
+        token TEXT UNIQUE,
+        interval_seconds INTEGER NOT NULL DEFAULT 60,
+        timeout_seconds INTEGER NOT NULL DEFAULT 10,
+        last_heartbeat TIMESTAMP,
+        PRIMARY KEY (guild_id, bot_id),
+        FOREIGN KEY (guild_id, bot_id) REFERENCES bots (guild_id, bot_id) ON DELETE CASCADE
+    );
+    """),
+    (8, 'per-guild notification locale and timezone', """
+    ALTER TABLE guild_settings
+        ADD COLUMN locale TEXT,
+        ADD COLUMN timezone TEXT;
+    """),
+    (9, 'notification subscriptions', """
+    CREATE TABLE subscriptions (
+        id BIGSERIAL PRIMARY KEY,
+        guild_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('channel', 'user', 'webhook')),
+        target TEXT NOT NULL,
+        created_by BIGINT,
+        UNIQUE (guild_id, bot_id, kind, target),
+        FOREIGN KEY (guild_id, bot_id) REFERENCES bots (guild_id, bot_id) ON DELETE CASCADE
+    );
+    CREATE INDEX subscriptions_guild_idx ON subscriptions (guild_id);
+    -- channels はギルドを持たないため、BOTを登録している全ギルドへ複製する。
+    -- 別ギルドのチャンネルは通知時に除外される
+    INSERT INTO subscriptions (guild_id, bot_id, kind, target)
+    SELECT b.guild_id, b.bot_id, 'channel', c.channel_id::text
+    FROM channels c JOIN bots b ON b.bot_id = c.bot_id
+    ON CONFLICT DO NOTHING;
+    """),
+    (10, 'notification outbox', """
+    -- 状態遷移と同じトランザクションで書き込み、送信は別のドレイナーが行う。1行が1つの送信先への1通知
+    CREATE TABLE notification_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        guild_id BIGINT NOT NULL,
+        bot_id BIGINT NOT NULL,
+        event TEXT NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('channel', 'user', 'webhook')),
+        target TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        claimed_by TEXT,
+        claimed_until TIMESTAMP,
+        sent_at TIMESTAMP,
+        FOREIGN KEY (guild_id, bot_id) REFERENCES bots (guild_id, bot_id) ON DELETE CASCADE
+    );
+    CREATE INDEX notification_outbox_pending_idx ON notification_outbox (id) WHERE sent_at IS NULL;
+    """),
+    (11, 'owner dm subscriptions', """
+    -- 登録者へのDMも購読として扱い、/unsubscribe で解除できるようにする
+    INSERT INTO subscriptions (guild_id, bot_id, kind, target, created_by)
+    SELECT guild_id, bot_id, 'user', user_id::text, user_id FROM bots
+    ON CONFLICT DO NOTHING;
+    """),
+]
+
+
+def apply_migrations(conn):
+    """未適用のマイグレーションをバージョン順に適用します。Database.run から呼び出されます"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_ID,))
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        );
+        """)
+        cursor.execute("SELECT version FROM schema_migrations;")
+        applied = {row[0] for row in cursor.fetchall()}
+        for version, name, query in MIGRATIONS:
+            if version in applied:
+                continue
+            cursor.execute(query)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+            logging.info("マイグレーションを適用しました: %d %s", version, name)
@@ -1,130 +1,459 @@
 from .db import Database
+from .migrations import apply_migrations
+from utils.metrics import timed_query
+from utils.uptime import HOUR, UptimeStats, ceil_day, floor_day, floor_hour, rollup_hours, split_window
 import logging
-from psycopg2.extras import RealDictCursor
+from datetime import datetime
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+# 送信に失敗し続ける通知(削除されたチャンネルなど)はこの回数で諦める
+OUTBOX_MAX_ATTEMPTS = 5
+
+# 通知状態は notification_state に分離されているため、BOTの行と結合して返す
+BOT_SELECT = """
+SELECT b.*, n.last_notification_time, n.last_dm_notification_time,
+       n.last_dm_online_notification_time, n.last_channel_notification_time,
+       n.last_channel_online_notification_time,
+       g.grace_seconds AS guild_grace_seconds, g.check_interval_seconds AS guild_check_interval_seconds,
+       g.renotify_seconds AS guild_renotify_seconds, g.locale AS guild_locale, g.timezone AS guild_timezone
+FROM bots b
+LEFT JOIN notification_state n ON n.guild_id = b.guild_id AND n.bot_id = b.bot_id
+LEFT JOIN guild_settings g ON g.guild_id = b.guild_id
+"""
 
 class BotTable:
     def __init__(self, db: Database):
         self.db = db
 
-    def create_dm_table(self):
+    @timed_query
+    async def migrate(self):
+        await self.db.run(apply_migrations)
+
+    @timed_query
+    async def add_bot(self, user_id, bot_id, name, last_online, guild_id):
+        """BOTを登録し、(新規に登録したかどうか, 登録者のユーザーID) を返します。登録済みの場合は名前だけを更新します
+
+        新規に登録した場合は登録者のDMへの購読も追加します。
+        """
         query = """
-        CREATE TABLE IF NOT EXISTS bots (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            bot_id BIGINT NOT NULL,
-            name TEXT NOT NULL,
-            last_online TIMESTAMP,
-            last_notification_time TIMESTAMP,
-            last_channel_notification_time TIMESTAMP,
-            last_dm_notification_time TIMESTAMP,
-            last_channel_online_notification_time TIMESTAMP,
-            last_dm_online_notification_time TIMESTAMP,
-            guild_id BIGINT NOT NULL
-        );
+        WITH bot AS (
+            INSERT INTO bots (user_id, bot_id, name, last_online, guild_id)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (guild_id, bot_id) DO UPDATE SET name = EXCLUDED.name
+            RETURNING (xmax = 0) AS inserted, guild_id, bot_id, user_id
+        ), owner AS (
+            INSERT INTO subscriptions (guild_id, bot_id, kind, target, created_by)
+            SELECT guild_id, bot_id, 'user', user_id::text, user_id FROM bot WHERE inserted
+            ON CONFLICT (guild_id, bot_id, kind, target) DO NOTHING
+        )
+        SELECT inserted, user_id FROM bot;
         """
-        self.db.execute(query, commit=True)
+        rows = await self.db.execute(query, (user_id, bot_id, name, last_online, guild_id), commit=True)
+        return rows[0]
 
-    def create_channel_table(self):
-        query = """
-        CREATE TABLE IF NOT EXISTS channels (
-            id SERIAL PRIMARY KEY,
-            channel_id BIGINT NOT NULL,
-            bot_id BIGINT NOT NULL,
-            name TEXT NOT NULL,
-            last_online TIMESTAMP,
-            last_notification_time TIMESTAMP,
-            last_channel_notification_time TIMESTAMP,
-            last_dm_notification_time TIMESTAMP,
-            last_channel_online_notification_time TIMESTAMP,
-            last_dm_online_notification_time TIMESTAMP
-        );
+    @timed_query
+    async def add_bots(self, guild_id, rows, created_by, overwrite=False):
+        """複数のBOTとそのチャンネル購読を1トランザクションで登録し、新規に登録した件数を返します
+
+        新規に登録したBOTには登録者のDMへの購読も追加します。
+
+        rows の各要素は bot_id, name, user_id と任意で各設定値、channels(チャンネルIDのリスト)を持つ辞書です。
+        overwrite が真の場合は登録済みのBOTの名前と設定も上書きします。
+        """
+        conflict = """
+        DO UPDATE SET name = EXCLUDED.name, grace_seconds = EXCLUDED.grace_seconds,
+            check_interval_seconds = EXCLUDED.check_interval_seconds, renotify_seconds = EXCLUDED.renotify_seconds
+        """ if overwrite else "DO NOTHING"
+        bots_query = f"""
+        INSERT INTO bots (guild_id, bot_id, user_id, name, last_online, grace_seconds, check_interval_seconds, renotify_seconds)
+        VALUES %s
+        ON CONFLICT (guild_id, bot_id) {conflict}
+        RETURNING (xmax = 0) AS inserted, bot_id, user_id;
         """
-        self.db.execute(query, commit=True)
+        subscriptions_query = """
+        INSERT INTO subscriptions (guild_id, bot_id, kind, target, created_by)
+        VALUES %s
+        ON CONFLICT (guild_id, bot_id, kind, target) DO NOTHING;
+        """
+        if not rows:
+            return 0
+        now = datetime.utcnow()
+        values = [(guild_id, row['bot_id'], row.get('user_id') or created_by, row['name'], now, row.get('grace_seconds'),
+                   row.get('check_interval_seconds'), row.get('renotify_seconds')) for row in rows]
+        subscriptions = [(guild_id, row['bot_id'], 'channel', str(channel_id), created_by)
+                         for row in rows for channel_id in row.get('channels') or ()]
+
+        def _add(conn):
+            with conn.cursor() as cursor:
+                result = execute_values(cursor, bots_query, values, page_size=1000, fetch=True)
+                owners = [(guild_id, bot_id, 'user', str(user_id), user_id) for inserted, bot_id, user_id in result if inserted]
+                if subscriptions or owners:
+                    execute_values(cursor, subscriptions_query, subscriptions + owners, page_size=1000)
+            return len(owners)
+        return await self.db.run(_add)
 
-    def add_bot(self, user_id, bot_id, name, last_online, guild_id):
+    @timed_query
+    async def add_subscription(self, guild_id, bot_id, kind, target, created_by):
         query = """
-        INSERT INTO bots (user_id, bot_id, name, last_online, guild_id)
+        INSERT INTO subscriptions (guild_id, bot_id, kind, target, created_by)
         VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (guild_id, bot_id, kind, target) DO NOTHING
         RETURNING id;
         """
-        return self.db.execute(query, (user_id, bot_id, name, last_online, guild_id), commit=True)
+        return await self.db.execute(query, (guild_id, bot_id, kind, str(target), created_by), commit=True)
 
-    def add_channel(self, bot_id, channel_id, channel_name):
+    @timed_query
+    async def remove_subscription(self, guild_id, bot_id, kind, target):
         query = """
-        INSERT INTO channels (bot_id, channel_id, name)
-        VALUES (%s, %s, %s)
+        DELETE FROM subscriptions WHERE guild_id = %s AND bot_id = %s AND kind = %s AND target = %s
         RETURNING id;
         """
-        return self.db.execute(query, (bot_id, channel_id, channel_name), commit=True)
+        return await self.db.execute(query, (guild_id, bot_id, kind, str(target)), commit=True)
+
+    @timed_query
+    async def get_subscriptions(self, guild_ids):
+        query = "SELECT guild_id, bot_id, kind, target FROM subscriptions WHERE guild_id = ANY(%s);"
+        return await self.db.execute(query, (list(guild_ids),), cursor_factory=RealDictCursor)
 
-    def remove_bot(self, bot_id):
+    @timed_query
+    async def remove_bot(self, guild_id, bot_id, user_id=None):
+        """ギルド内のBOTの登録を削除します。user_id を指定した場合はその登録者の行だけを削除します"""
         query = """
-        DELETE FROM bots WHERE bot_id = %s;
+        DELETE FROM bots WHERE guild_id = %s AND bot_id = %s AND (%s::bigint IS NULL OR user_id = %s)
+        RETURNING bot_id;
         """
-        self.db.execute(query, (bot_id,), commit=True)
+        return await self.db.execute(query, (guild_id, bot_id, user_id, user_id), commit=True)
 
-    def update_bot(self, bot_id, **kwargs):
+    @timed_query
+    async def update_bot(self, bot_id, **kwargs):
         set_clause = ', '.join([f"{key} = %s" for key in kwargs])
         values = list(kwargs.values())
         query = f"UPDATE bots SET {set_clause} WHERE bot_id = %s;"
         values.append(bot_id)
-        self.db.execute(query, values, commit=True)
+        await self.db.execute(query, values, commit=True)
+
+    @timed_query
+    async def update_bot_settings(self, guild_id, bot_id, grace_seconds, check_interval_seconds, renotify_seconds):
+        query = """
+        UPDATE bots SET grace_seconds = %s, check_interval_seconds = %s, renotify_seconds = %s
+        WHERE guild_id = %s AND bot_id = %s;
+        """
+        await self.db.execute(query, (grace_seconds, check_interval_seconds, renotify_seconds, guild_id, bot_id), commit=True)
 
-    def get_bots(self, guild_id):
-        query = "SELECT * FROM bots WHERE guild_id = %s"
-        result = self.db.execute(query, (guild_id,))
-        logging.debug(f"Query: {query} result: {result}")
+    @timed_query
+    async def update_guild_settings(self, guild_id, grace_seconds, check_interval_seconds, renotify_seconds):
+        query = """
+        INSERT INTO guild_settings (guild_id, grace_seconds, check_interval_seconds, renotify_seconds)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (guild_id) DO UPDATE SET
+            grace_seconds = EXCLUDED.grace_seconds,
+            check_interval_seconds = EXCLUDED.check_interval_seconds,
+            renotify_seconds = EXCLUDED.renotify_seconds;
+        """
+        await self.db.execute(query, (guild_id, grace_seconds, check_interval_seconds, renotify_seconds), commit=True)
+
+    @timed_query
+    async def update_guild_locale(self, guild_id, locale, timezone):
+        query = """
+        INSERT INTO guild_settings (guild_id, locale, timezone)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (guild_id) DO UPDATE SET locale = EXCLUDED.locale, timezone = EXCLUDED.timezone;
+        """
+        await self.db.execute(query, (guild_id, locale, timezone), commit=True)
+
+    @timed_query
+    async def get_bots(self, guild_id):
+        query = f"{BOT_SELECT} WHERE b.guild_id = %s;"
+        result = await self.db.execute(query, (guild_id,), cursor_factory=RealDictCursor)
+        logging.debug("Query: %s result: %s", query, result)
         return result
     
-    def reset_table(self):
-        query = "TRUNCATE TABLE bots;"
-        self.db.execute(query, commit=True)
-        query = "TRUNCATE TABLE channels;"
-        self.db.execute(query, commit=True)
+    @timed_query
+    async def get_user_bots(self, user_id, guild_id):
+        query = f"{BOT_SELECT} WHERE b.user_id = %s AND b.guild_id = %s ORDER BY b.name;"
+        return await self.db.execute(query, (user_id, guild_id), cursor_factory=RealDictCursor)
+
+    @timed_query
+    async def get_monitored_bots(self, guild_ids):
+        # 全ギルドの監視対象BOTと通知状態・設定を1クエリで取得する
+        query = """
+        SELECT b.*, n.last_notification_time, n.last_dm_notification_time,
+               n.last_dm_online_notification_time, n.last_channel_notification_time,
+               n.last_channel_online_notification_time,
+               g.grace_seconds AS guild_grace_seconds, g.check_interval_seconds AS guild_check_interval_seconds,
+               g.renotify_seconds AS guild_renotify_seconds, g.locale AS guild_locale, g.timezone AS guild_timezone,
+               p.kind AS probe_kind, p.url AS probe_url, p.interval_seconds AS probe_interval_seconds,
+               p.timeout_seconds AS probe_timeout_seconds, p.last_heartbeat,
+               EXISTS (SELECT 1 FROM bot_status_events e WHERE e.guild_id = b.guild_id AND e.bot_id = b.bot_id) AS has_history
+        FROM bots b
+        LEFT JOIN notification_state n ON n.guild_id = b.guild_id AND n.bot_id = b.bot_id
+        LEFT JOIN guild_settings g ON g.guild_id = b.guild_id
+        LEFT JOIN bot_probes p ON p.guild_id = b.guild_id AND p.bot_id = b.bot_id
+        WHERE b.guild_id = ANY(%s);
+        """
+        return await self.db.execute(query, (list(guild_ids),), cursor_factory=RealDictCursor)
+
+    @timed_query
+    async def save_bot_states(self, online_rows, notification_rows, outbox_rows=()):
+        """(guild_id, bot_id, last_online) と (guild_id, bot_id, last_notification_time,
+        last_dm_notification_time, last_dm_online_notification_time, last_channel_notification_time,
+        last_channel_online_notification_time) のタプルを1トランザクションでまとめて書き込みます
+
+        outbox_rows の (idempotency_key, guild_id, bot_id, event, kind, target, payload) も同じトランザクションで
+        送信待ちの通知として追加するため、状態だけが保存されて通知が失われることはありません。
+        """
+        bots_query = """
+        UPDATE bots AS b SET last_online = v.last_online
+        FROM (VALUES %s) AS v(guild_id, bot_id, last_online)
+        WHERE b.guild_id = v.guild_id AND b.bot_id = v.bot_id;
+        """
+        state_query = """
+        INSERT INTO notification_state (
+            guild_id, bot_id, last_notification_time, last_dm_notification_time,
+            last_dm_online_notification_time, last_channel_notification_time,
+            last_channel_online_notification_time
+        )
+        SELECT v.* FROM (VALUES %s) AS v(guild_id, bot_id, last_notification_time, last_dm_notification_time,
+                                         last_dm_online_notification_time, last_channel_notification_time,
+                                         last_channel_online_notification_time)
+        JOIN bots ON bots.guild_id = v.guild_id AND bots.bot_id = v.bot_id
+        ON CONFLICT (guild_id, bot_id) DO UPDATE SET
+            last_notification_time = EXCLUDED.last_notification_time,
+            last_dm_notification_time = EXCLUDED.last_dm_notification_time,
+            last_dm_online_notification_time = EXCLUDED.last_dm_online_notification_time,
+            last_channel_notification_time = EXCLUDED.last_channel_notification_time,
+            last_channel_online_notification_time = EXCLUDED.last_channel_online_notification_time;
+        """
+        outbox_query = """
+        INSERT INTO notification_outbox (idempotency_key, guild_id, bot_id, event, kind, target, payload)
+        SELECT v.* FROM (VALUES %s) AS v(idempotency_key, guild_id, bot_id, event, kind, target, payload)
+        JOIN bots ON bots.guild_id = v.guild_id AND bots.bot_id = v.bot_id
+        ON CONFLICT (idempotency_key) DO NOTHING;
+        """
+        if not online_rows and not notification_rows and not outbox_rows:
+            return
+        outbox_rows = [row[:5] + (str(row[5]), Json(row[6])) for row in outbox_rows]
 
-    def find_user_by_bot_id(self, bot_id):
+        def _save(conn):
+            with conn.cursor() as cursor:
+                if online_rows:
+                    execute_values(cursor, bots_query, online_rows, template="(%s, %s, %s::timestamp)")
+                if notification_rows:
+                    execute_values(cursor, state_query, notification_rows,
+                                   template="(%s::bigint, %s::bigint, %s::timestamp, %s::timestamp, %s::timestamp, %s::timestamp, %s::timestamp)")
+                if outbox_rows:
+                    execute_values(cursor, outbox_query, outbox_rows,
+                                   template="(%s, %s::bigint, %s::bigint, %s, %s, %s, %s::jsonb)")
+        await self.db.run(_save)
+
+    @timed_query
+    async def claim_notifications(self, worker_id, limit=100, lease_seconds=120, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        """送信待ちの通知を最大 limit 件確保します
+
+        FOR UPDATE SKIP LOCKED により複数のワーカーが同時に呼び出しても同じ行は確保されません。
+        確保した行は lease_seconds の間は他のワーカーから見えず、送信前に落ちた場合は期限切れ後に再送されます。
+        """
+        query = """
+        UPDATE notification_outbox AS o
+        SET claimed_by = %s, claimed_until = (now() AT TIME ZONE 'utc') + %s * interval '1 second', attempts = o.attempts + 1
+        WHERE o.id IN (
+            SELECT id FROM notification_outbox
+            WHERE sent_at IS NULL AND attempts < %s
+              AND (claimed_until IS NULL OR claimed_until < (now() AT TIME ZONE 'utc'))
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING o.id, o.idempotency_key, o.guild_id, o.bot_id, o.event, o.kind, o.target, o.payload, o.attempts;
+        """
+        return await self.db.execute(query, (worker_id, lease_seconds, max_attempts, limit), commit=True,
+                                     cursor_factory=RealDictCursor) or []
+
+    @timed_query
+    async def finish_notifications(self, sent_ids):
+        """送信済みの行を完了にします。失敗した行は確保の期限が切れるまで再送されません"""
+        if not sent_ids:
+            return
+        query = "UPDATE notification_outbox SET sent_at = (now() AT TIME ZONE 'utc'), claimed_until = NULL WHERE id = ANY(%s);"
+        await self.db.execute(query, (list(sent_ids),), commit=True)
+
+    @timed_query
+    async def purge_notifications(self, before, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        query = "DELETE FROM notification_outbox WHERE created_at < %s AND (sent_at IS NOT NULL OR attempts >= %s);"
+        await self.db.execute(query, (before, max_attempts), commit=True)
+
+    @timed_query
+    async def set_probe(self, guild_id, bot_id, kind, url, token, interval_seconds, timeout_seconds):
+        query = """
+        INSERT INTO bot_probes (guild_id, bot_id, kind, url, token, interval_seconds, timeout_seconds)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (guild_id, bot_id) DO UPDATE SET
+            kind = EXCLUDED.kind,
+            url = EXCLUDED.url,
+            token = EXCLUDED.token,
+            interval_seconds = EXCLUDED.interval_seconds,
+            timeout_seconds = EXCLUDED.timeout_seconds,
+            last_heartbeat = NULL;
+        """
+        await self.db.execute(query, (guild_id, bot_id, kind, url, token, interval_seconds, timeout_seconds), commit=True)
+
+    @timed_query
+    async def remove_probe(self, guild_id, bot_id):
+        query = "DELETE FROM bot_probes WHERE guild_id = %s AND bot_id = %s;"
+        await self.db.execute(query, (guild_id, bot_id), commit=True)
+
+    @timed_query
+    async def record_heartbeat(self, token):
+        query = "UPDATE bot_probes SET last_heartbeat = (now() AT TIME ZONE 'utc') WHERE token = %s AND kind = 'heartbeat' RETURNING guild_id, bot_id;"
+        result = await self.db.execute(query, (token,), commit=True)
+        return result[0] if result else None
+
+    @timed_query
+    async def get_heartbeats(self, guild_ids):
+        query = """
+        SELECT guild_id, bot_id, last_heartbeat FROM bot_probes
+        WHERE kind = 'heartbeat' AND guild_id = ANY(%s);
+        """
+        return await self.db.execute(query, (list(guild_ids),), cursor_factory=RealDictCursor)
+
+    @timed_query
+    async def reset_table(self):
+        # 登録内容と、それに紐づく設定・履歴を消す。シャードのリースとマイグレーションの記録は残す。
+        # bots を参照するテーブルが今後増えても失敗しないよう CASCADE を付ける
+        query = """
+        TRUNCATE TABLE notification_outbox, subscriptions, notification_state, bot_probes, bots, channels,
+            guild_settings, bot_status_events, bot_uptime_rollups, rollup_watermark CASCADE;
+        """
+        await self.db.execute(query, commit=True)
+
+    @timed_query
+    async def find_user_by_bot_id(self, bot_id):
         query = "SELECT user_id FROM bots WHERE bot_id = %s"
-        result = self.db.execute(query, (bot_id,), cursor_factory=RealDictCursor)
+        result = await self.db.execute(query, (bot_id,), cursor_factory=RealDictCursor)
         if result:
             return result[0]['user_id']
         return None
 
-    def get_bot_data(self, bot_id):
-        query = "SELECT * FROM bots WHERE bot_id = %s;"
-        result = self.db.execute(query, (bot_id,), cursor_factory=RealDictCursor)
+    @timed_query
+    async def get_bot_data(self, bot_id):
+        query = f"{BOT_SELECT} WHERE b.bot_id = %s;"
+        result = await self.db.execute(query, (bot_id,), cursor_factory=RealDictCursor)
         if result:
             return result[0]  # 最初の結果を辞書型で返す
         return None
 
-    def update_last_notification_time(self, bot_id, new_time, column_name):
-        query = f"UPDATE bots SET {column_name} = %s WHERE bot_id = %s;"
-        self.db.execute(query, (new_time, bot_id), commit=True)
 
 
-    def reset_last_notification_time(self, bot_id):
-        query = "UPDATE bots SET last_notification_time = NULL WHERE bot_id = %s;"
-        self.db.execute(query, (bot_id,), commit=True)
+class HistoryTable:
+    def __init__(self, db: Database):
+        self.db = db
+
+    @timed_query
+    async def insert_status_events(self, events):
+        """(guild_id, bot_id, online, occurred_at) のタプルをまとめて追記します"""
+        query = "INSERT INTO bot_status_events (guild_id, bot_id, online, occurred_at) VALUES %s;"
+        if not events:
+            return
+
+        def _insert(conn):
+            with conn.cursor() as cursor:
+                execute_values(cursor, query, events)
+        await self.db.run(_insert)
 
-    def update_last_dm_notification_time(self, bot_id, new_time):
-        query = "UPDATE bots SET last_dm_notification_time = %s WHERE bot_id = %s;"
-        self.db.execute(query, (new_time, bot_id), commit=True)
+    @timed_query
+    async def roll_up(self, until, max_hours=24, recheck_hours=2):
+        """集計済みの時刻から until までの完了した時間帯を集計し、集計済みの時刻を返します
 
-    def update_last_channel_notification_time(self, bot_id, new_time):
-        query = "UPDATE channels SET last_channel_notification_time = %s WHERE bot_id = %s;"
-        self.db.execute(query, (new_time, bot_id), commit=True)
+        状態の変化はバッファしてから書き込まれ、失敗時の再送や複数のワーカーからの書き込みで遅れて届くため、
+        集計済みの時刻より前の recheck_hours 時間も毎回集計し直します。
+        """
+        initial_query = """
+        SELECT b.guild_id, b.bot_id, e.online, e.occurred_at
+        FROM bots b
+        CROSS JOIN LATERAL (
+            SELECT online, occurred_at FROM bot_status_events
+            WHERE guild_id = b.guild_id AND bot_id = b.bot_id AND occurred_at < %s
+            ORDER BY occurred_at DESC LIMIT 1
+        ) e;
+        """
+        events_query = """
+        SELECT guild_id, bot_id, online, occurred_at FROM bot_status_events
+        WHERE occurred_at >= %s AND occurred_at < %s
+        ORDER BY guild_id, bot_id, occurred_at;
+        """
+        hourly_query = """
+        INSERT INTO bot_uptime_rollups (guild_id, bot_id, granularity, bucket, online_seconds,
+                                        offline_seconds, outages, recoveries, repair_seconds)
+        VALUES %s
+        ON CONFLICT (guild_id, bot_id, granularity, bucket) DO UPDATE SET
+            online_seconds = EXCLUDED.online_seconds,
+            offline_seconds = EXCLUDED.offline_seconds,
+            outages = EXCLUDED.outages,
+            recoveries = EXCLUDED.recoveries,
+            repair_seconds = EXCLUDED.repair_seconds;
+        """
+        daily_query = """
+        INSERT INTO bot_uptime_rollups (guild_id, bot_id, granularity, bucket, online_seconds,
+                                        offline_seconds, outages, recoveries, repair_seconds)
+        SELECT guild_id, bot_id, 'day', date_trunc('day', bucket), sum(online_seconds),
+               sum(offline_seconds), sum(outages), sum(recoveries), sum(repair_seconds)
+        FROM bot_uptime_rollups
+        WHERE granularity = 'hour' AND bucket >= %s AND bucket < %s
+        GROUP BY guild_id, bot_id, date_trunc('day', bucket)
+        ON CONFLICT (guild_id, bot_id, granularity, bucket) DO UPDATE SET
+            online_seconds = EXCLUDED.online_seconds,
+            offline_seconds = EXCLUDED.offline_seconds,
+            outages = EXCLUDED.outages,
+            recoveries = EXCLUDED.recoveries,
+            repair_seconds = EXCLUDED.repair_seconds;
+        """
 
-    def update_last_channel_online_notification_time(self, bot_id, new_time):
-        query = "UPDATE channels SET last_channel_online_notification_time = %s WHERE bot_id = %s;"
-        self.db.execute(query, (new_time, bot_id), commit=True)
+        def _roll_up(conn):
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT rolled_until FROM rollup_watermark FOR UPDATE;")
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("SELECT min(occurred_at) FROM bot_status_events;")
+                    first = cursor.fetchone()[0]
+                    if first is None:
+                        return None
+                    start = floor_hour(first)
+                else:
+                    start = row[0] - HOUR * recheck_hours
+                end = min(floor_hour(until), start + HOUR * max_hours)
+                if end <= start:
+                    return row[0] if row is not None else start
 
-    def update_last_dm_online_notification_time(self, bot_id, new_time):
-        query = "UPDATE bots SET last_dm_online_notification_time = %s WHERE bot_id = %s;"
-        self.db.execute(query, (new_time, bot_id), commit=True)
+                cursor.execute(initial_query, (start,))
+                initial = {(guild_id, bot_id): (online, at) for guild_id, bot_id, online, at in cursor.fetchall()}
+                cursor.execute(events_query, (start, end))
+                events = {}
+                for guild_id, bot_id, online, at in cursor.fetchall():
+                    events.setdefault((guild_id, bot_id), []).append((at, online))
 
-    def get_notification_channel(self, bot_id):
-        query = "SELECT channel_id FROM channels WHERE bot_id = %s;"
-        result = self.db.execute(query, (bot_id,), cursor_factory=RealDictCursor)
-        if result:
-            return result[0]['channel_id']
-        return None
+                rows = rollup_hours(events, initial, start, end)
+                execute_values(cursor, hourly_query, rows, template="(%s, %s, 'hour', %s, %s, %s, %s, %s, %s)")
+                cursor.execute(daily_query, (floor_day(start), ceil_day(end)))
+                cursor.execute("""
+                INSERT INTO rollup_watermark (rolled_until) VALUES (%s)
+                ON CONFLICT (id) DO UPDATE SET rolled_until = EXCLUDED.rolled_until;
+                """, (end,))
+                return end
+        return await self.db.run(_roll_up)
 
+    @timed_query
+    async def get_uptime(self, guild_id, bot_id, start, end):
+        # 日単位で賄える範囲は日次集計、端数は時間単位の集計から求める
+        query = """
+        SELECT coalesce(sum(online_seconds), 0), coalesce(sum(offline_seconds), 0),
+               coalesce(sum(outages), 0), coalesce(sum(recoveries), 0), coalesce(sum(repair_seconds), 0)
+        FROM bot_uptime_rollups
+        WHERE guild_id = %s AND bot_id = %s AND (
+            (granularity = 'day' AND bucket >= %s AND bucket < %s)
+            OR (granularity = 'hour' AND bucket >= %s AND bucket < %s)
+            OR (granularity = 'hour' AND bucket >= %s AND bucket < %s)
+        );
+        """
+        day_start, day_end = split_window(start, end)
+        result = await self.db.execute(query, (guild_id, bot_id, day_start, day_end, start, day_start, day_end, end))
+        return UptimeStats(*result[0])
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import os
+
+CACHE_PATH = 'data/extensions.json'
+
+
+class ExtensionManifest:
+    """cogs 以下の拡張機能の一覧をキャッシュします
+
+    ディレクトリごとの更新時刻を一緒に保存し、どれかが変わった場合(ファイルの追加・削除・名前の変更)だけ
+    ディレクトリを走査し直します。一覧は再起動後も使えるようファイルにも保存します。
+    """
+
+    def __init__(self, root='cogs', cache_path=CACHE_PATH):
+        self.root = root
+        self.cache_path = cache_path
+        self._dirs = None
+        self._modules = None
+        self._state = {}
+
+    def modules(self):
+        if self._modules is None:
+            self._load()
+        if self._modules is None or not self._is_fresh():
+            self._scan()
+        return list(self._modules)
+
+    def get_state(self, key):
+        if self._modules is None:
+            self._load()
+        return self._state.get(key)
+
+    def set_state(self, key, value):
+        self._state[key] = value
+        self._save()
+
+    def _is_fresh(self):
+        for path, mtime in self._dirs.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _scan(self):
+        dirs = {}
+        modules = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(name for name in dirnames if name not in ('backup', '__pycache__'))
+            dirs[dirpath] = os.stat(dirpath).st_mtime_ns
+            for filename in sorted(filenames):
+                if not filename.endswith('.py') or filename == '__init__.py':
+                    continue
+                module = os.path.join(dirpath, filename[:-3]).replace(os.sep, '.')
+                modules.append(module)
+        self._dirs = dirs
+        self._modules = modules
+        logging.debug("拡張機能の一覧を更新しました: %d件", len(modules))
+        self._save()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._dirs = data['dirs']
+            self._modules = data['modules']
+            self._state = data.get('state', {})
+        except (OSError, ValueError, KeyError):
+            self._dirs = None
+            self._modules = None
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'dirs': self._dirs, 'modules': self._modules, 'state': self._state}, f)
+        except OSError as e:
+            logging.warning("拡張機能の一覧を保存できませんでした: %s", e)
+
+
+manifest = ExtensionManifest()
+
+
+def command_tree_hash(tree, application_id):
+    payload = sorted((command.to_dict() for command in tree.get_commands()), key=lambda command: (command.get('type', 1), command['name']))
+    data = json.dumps({'application_id': application_id, 'commands': payload}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+async def sync_tree_if_changed(bot):
+    """前回の同期からコマンドツリーが変わった場合だけ tree.sync() を呼び出します"""
+    digest = command_tree_hash(bot.tree, bot.application_id)
+    if manifest.get_state('tree_hash') == digest:
+        logging.info("コマンドツリーに変更がないため同期を省略しました。")
+        return False
+    await bot.tree.sync()
+    manifest.set_state('tree_hash', digest)
+    logging.info("コマンドツリーを同期しました。")
+    return True
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+
+class FlapDetector:
+    """オンライン/オフラインを繰り返すBOTを検出します
+
+    BOTごとに直近 slots 個の時間枠を1ビットずつ持つリングバッファ(int)を保持し、
+    状態が切り替わった枠のビットを立てます。ビットが立っている枠の割合をフラップスコアとし、
+    high 以上で不安定、low 以下で安定とみなします(ヒステリシス)。
+    """
+
+    def __init__(self, slots=20, slot_length=timedelta(minutes=1), high=0.3, low=0.1):
+        self.slots = slots
+        self.slot_length = slot_length
+        self.high = high
+        self.low = low
+        self._mask = (1 << slots) - 1
+        self._slot_seconds = slot_length.total_seconds()
+
+    def record(self, bot, now):
+        """状態の切り替わりを記録し、フラップスコアを返します"""
+        self._advance(bot, now)
+        bot.flap_bits |= 1
+        return self._score(bot)
+
+    def score(self, bot, now):
+        self._advance(bot, now)
+        return self._score(bot)
+
+    def is_flapping(self, score):
+        return score >= self.high
+
+    def is_settled(self, score):
+        return score <= self.low
+
+    def _advance(self, bot, now):
+        slot = int(now.timestamp() // self._slot_seconds)
+        shift = slot - bot.flap_slot
+        if shift >= self.slots:
+            bot.flap_bits = 0
+        elif shift > 0:
+            bot.flap_bits = (bot.flap_bits << shift) & self._mask
+        if shift > 0:
+            bot.flap_slot = slot
+
+    def _score(self, bot):
+        return bin(bot.flap_bits).count('1') / self.slots
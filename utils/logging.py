@@ -1,31 +1,129 @@
+import atexit
+import gzip
 import json
+import logging
+import logging.handlers
 import os
-from datetime import datetime
+import queue
 import shutil
-import uuid
+from datetime import datetime, timedelta
+from enum import Enum
 
-def save_log(log_data):
-    date_str = datetime.now().strftime('%Y-%m-%d')
-    time_str = datetime.now().strftime('%H-%M-%S')
-    base_dir_path = 'data/logging'
-    dir_path = f'{base_dir_path}/{date_str}/{time_str}'
+LOG_DIR = 'data/logging'
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# 書き込みまで整形を遅らせても内容が変わらない引数の型
+IMMUTABLE_ARGS = (str, bytes, int, float, complex, datetime, timedelta, Enum)
+
+_listener = None
+_event_logger = logging.getLogger('events')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data = getattr(record, 'data', None)
+        if data:
+            entry['data'] = data
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """サイズ上限または日付の変わり目でローテーションし、古いファイルをgzip圧縮するハンドラ"""
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=14, encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._compress
+        self._rollover_at = self._next_midnight()
+
+    def shouldRollover(self, record):
+        if record.created >= self._rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._rollover_at = self._next_midnight()
+
+    @staticmethod
+    def _next_midnight():
+        tomorrow = datetime.now() + timedelta(days=1)
+        return tomorrow.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
 
-    if base_dir_path not in os.listdir():
-        os.makedirs(base_dir_path, exist_ok=True)
+    @staticmethod
+    def _compress(source, dest):
+        if not os.path.exists(source):
+            return
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
 
-    date_folders = [f for f in os.listdir(base_dir_path) if os.path.isdir(os.path.join(base_dir_path, f))]
-    if len(date_folders) > 10:
-        oldest_folder = sorted(date_folders)[0]
-        archive_path = os.path.join(base_dir_path, 'archive', oldest_folder)
-        shutil.move(os.path.join(base_dir_path, oldest_folder), archive_path)
 
-    os.makedirs(dir_path, exist_ok=True)
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # 標準の QueueHandler は呼び出し側のスレッドでメッセージを整形するため、整形もライター側に任せる。
+    # ただし変更可能なオブジェクトが引数にあると書き込みまでに内容が変わるため、その場合だけここで整形する
+    def prepare(self, record):
+        args = record.args
+        if args and not _immutable_args(args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
 
-    file_name = f'{uuid.uuid4()}.json'
 
-    file_path = os.path.join(dir_path, file_name)
+def _immutable_args(args):
+    values = args.values() if isinstance(args, dict) else args
+    return all(value is None or isinstance(value, IMMUTABLE_ARGS) for value in values)
 
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(log_data, file, ensure_ascii=False, indent=4)
 
-    print(f'Log saved to {file_path}')
+def parse_levels(value):
+    """'discord=INFO,health-check=DEBUG' のような指定をロガー名とレベルの辞書に変換します"""
+    levels = {}
+    for part in (value or '').split(','):
+        name, _, level = part.strip().partition('=')
+        if name and level:
+            levels[name] = level.upper()
+    return levels
+
+
+def log_filename():
+    # ランチャーから起動した複数のワーカーが同じファイルをローテーションしないよう、ワーカーごとにファイルを分ける
+    worker_id = os.getenv('WORKER_ID')
+    return f"bot-{worker_id}.jsonl" if worker_id else 'bot.jsonl'
+
+
+def setup_logging(level=None, levels=None, log_dir=LOG_DIR):
+    """ルートロガーをキュー経由にし、コンソール出力とJSON Linesファイルへの書き込みをバックグラウンドスレッドで行います"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    os.makedirs(log_dir, exist_ok=True)
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    file_handler = CompressingRotatingFileHandler(os.path.join(log_dir, log_filename()))
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, module_level in (levels if levels is not None else parse_levels(os.getenv('LOG_LEVELS'))).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, console, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+def save_log(log_data):
+    _event_logger.info("%s", log_data.get('event', 'event'), extra={'data': log_data})
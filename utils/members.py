@@ -0,0 +1,54 @@
+import discord
+
+import asyncio
+import logging
+
+# ゲートウェイの REQUEST_GUILD_MEMBERS で一度に指定できるユーザー数の上限
+QUERY_LIMIT = 100
+
+
+def is_lazy(guild):
+    """メンバー一覧を起動時に取得していない(低メモリモードの)ギルドかどうか"""
+    return not guild.chunked
+
+
+async def load_members(guild, user_ids, presences=False, cache=False):
+    """指定したメンバーをキャッシュから、なければゲートウェイから取得して {user_id: member} を返します
+
+    cache=True の場合は取得したメンバーをキャッシュに追加し、以降は presence の更新を受け取れるようにします。
+    """
+    found = {}
+    missing = []
+    for user_id in user_ids:
+        member = guild.get_member(user_id)
+        if member is not None:
+            found[user_id] = member
+        else:
+            missing.append(user_id)
+    if not missing or not is_lazy(guild):
+        return found
+    for index in range(0, len(missing), QUERY_LIMIT):
+        try:
+            members = await guild.query_members(user_ids=missing[index:index + QUERY_LIMIT], presences=presences, cache=cache)
+        except asyncio.TimeoutError:
+            logging.warning("メンバーの取得がタイムアウトしました: %s", guild.id)
+            continue
+        found.update((member.id, member) for member in members)
+    return found
+
+
+async def search_members(guild, query, limit=25, timeout=2.0):
+    """名前の前方一致でメンバーを検索します。キャッシュには追加せず、タイムアウトや検索できない場合は None を返します
+
+    オートコンプリートは3秒以内に応答する必要があるため、既定では2秒で打ち切ります。
+    """
+    try:
+        return await asyncio.wait_for(guild.query_members(query=query, limit=limit, cache=False), timeout)
+    except (asyncio.TimeoutError, ValueError, discord.ClientException):
+        return None
+
+
+async def all_members(guild):
+    if not is_lazy(guild):
+        return guild.members
+    return await guild.chunk(cache=False)
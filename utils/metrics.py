@@ -0,0 +1,241 @@
+import asyncio
+import bisect
+import functools
+import logging
+import math
+import time
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _render_child(self, values, child):
+        yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        """スクレイプ時に呼び出され、{ラベル値のタプル: 値} を返す関数を設定します"""
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            try:
+                for values, value in self._function().items():
+                    self.labels(*values).set(value)
+            except Exception:
+                logging.exception("メトリクスの取得に失敗しました: %s", self.name)
+        return super().render()
+
+    def _render_child(self, values, child):
+        yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _HistogramValue:
+    __slots__ = ('upper_bounds', 'counts', 'sum')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('target', 'start')
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, values, child):
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (math.inf,), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, ('le', _format_value(bound)))
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, values)} {_format_value(child.sum)}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, values)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+SWEEP_SECONDS = Histogram('healthcheck_sweep_seconds', 'Duration of a check_bots reconciliation sweep')
+SWEEP_BOTS = Gauge('healthcheck_monitored_bots', 'Number of bots tracked by this worker')
+DB_QUERY_SECONDS = Histogram('healthcheck_db_query_seconds', 'Latency of database calls by table method', ['method'])
+DB_QUERY_ERRORS = Counter('healthcheck_db_query_errors_total', 'Failed database calls by table method', ['method'])
+NOTIFY_SECONDS = Histogram('healthcheck_notification_send_seconds', 'Latency of notification sends by route kind', ['kind'])
+NOTIFY_FAILURES = Counter('healthcheck_notification_failures_total', 'Notification sends that failed after retries', ['kind'])
+LOOP_LAG_SECONDS = Histogram('healthcheck_event_loop_lag_seconds', 'Event loop scheduling lag',
+                             buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+GATEWAY_LATENCY_SECONDS = Gauge('healthcheck_gateway_latency_seconds', 'Gateway heartbeat latency per shard', ['shard'])
+PROBE_SECONDS = Histogram('healthcheck_probe_seconds', 'Latency of HTTP health probes', ['result'])
+HEARTBEATS = Counter('healthcheck_heartbeats_total', 'Heartbeats received on the push endpoint', ['result'])
+
+
+def timed_query(fn):
+    """BotTable などの非同期メソッドの所要時間をメソッド名ごとに記録するデコレータ"""
+    histogram = DB_QUERY_SECONDS.labels(method=fn.__name__)
+    errors = DB_QUERY_ERRORS.labels(method=fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+async def monitor_loop_lag(interval=0.5):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(time.perf_counter() - start - interval, 0.0))
+
+
+async def start_server(port, host='127.0.0.1'):
+    """/metrics を提供するHTTPサーバーを起動します。スクレイプされない間は何も処理しません"""
+    async def handle_metrics(request):
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("メトリクスサーバーを起動しました: http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,320 @@
+import asyncio
+import functools
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Optional
+
+from utils.scheduler import DueScheduler
+
+DEFAULT_GRACE = timedelta(minutes=10)
+DEFAULT_CHECK_INTERVAL = timedelta(minutes=1)
+DEFAULT_RENOTIFY = timedelta(minutes=10)
+EPOCH = datetime(1970, 1, 1)
+# 判定元と、その状態を保持する MonitoredBot の属性
+SOURCES = {'presence': 'presence_up', 'probe': 'probe_up'}
+
+
+class BotState(Enum):
+    ONLINE = 'online'
+    OFFLINE_PENDING = 'offline_pending'
+    OFFLINE_NOTIFIED = 'offline_notified'
+    UNSTABLE = 'unstable'
+
+
+@dataclass(slots=True, eq=False)
+class MonitoredBot:
+    """監視中のBOT1件分の状態
+
+    BOTの数だけ生成されるため __slots__ で属性辞書を持たせず、IDは int、時刻はUTCのエポック秒(float)で保持します。
+    データベースとの間では from_row / state_row で datetime と相互に変換します。
+    """
+
+    guild_id: int
+    bot_id: int
+    user_id: int
+    name: str
+    last_online: Optional[float] = None
+    state: BotState = BotState.ONLINE
+    last_notified: Optional[float] = None
+    # 全ての判定元を合わせた直近の状態。UNSTABLE の間も切り替わりを追跡する
+    online: Optional[bool] = None
+    last_dm_notified: Optional[float] = None
+    last_dm_online_notified: Optional[float] = None
+    last_channel_notified: Optional[float] = None
+    last_channel_online_notified: Optional[float] = None
+    grace: Optional[timedelta] = None
+    check_interval: Optional[timedelta] = None
+    renotify: Optional[timedelta] = None
+    probe_kind: Optional[str] = None
+    probe_url: Optional[str] = None
+    probe_interval: Optional[timedelta] = None
+    probe_timeout: Optional[timedelta] = None
+    last_heartbeat: Optional[float] = None
+    locale: Optional[str] = None
+    timezone: Optional[str] = None
+    # 判定元(presence/probe)ごとの最新の状態(None は未判定)。判定済みのすべてが正常な場合のみオンラインとみなす
+    presence_up: Optional[bool] = None
+    probe_up: Optional[bool] = None
+    flap_bits: int = 0
+    flap_slot: int = 0
+
+    def __post_init__(self):
+        if self.online is None:
+            self.online = self.state is BotState.ONLINE
+
+    def sources_up(self):
+        return self.presence_up is not False and self.probe_up is not False
+
+    @property
+    def key(self):
+        return (self.guild_id, self.bot_id)
+
+    @classmethod
+    def from_row(cls, row):
+        # 通知済みのまま再起動した場合はオフライン通知済みとして復元する
+        last_notified = to_epoch(row.get('last_notification_time'))
+        state = BotState.OFFLINE_NOTIFIED if last_notified is not None else BotState.ONLINE
+        bot = cls(row['guild_id'], row['bot_id'], row['user_id'], row['name'],
+                  last_online=to_epoch(row.get('last_online')), state=state, last_notified=last_notified)
+        bot.last_dm_notified = to_epoch(row.get('last_dm_notification_time'))
+        bot.last_dm_online_notified = to_epoch(row.get('last_dm_online_notification_time'))
+        bot.last_channel_notified = to_epoch(row.get('last_channel_notification_time'))
+        bot.last_channel_online_notified = to_epoch(row.get('last_channel_online_notification_time'))
+        bot.apply_settings(row)
+        return bot
+
+    def refresh(self, row):
+        self.user_id = row['user_id']
+        self.name = row['name']
+        self.apply_settings(row)
+
+    def apply_settings(self, row):
+        # BOT個別の設定がなければギルドの既定値、それもなければ全体の既定値を使う
+        self.grace = _seconds(row.get('grace_seconds'), row.get('guild_grace_seconds'), DEFAULT_GRACE)
+        self.check_interval = _seconds(row.get('check_interval_seconds'), row.get('guild_check_interval_seconds'), DEFAULT_CHECK_INTERVAL)
+        self.renotify = _seconds(row.get('renotify_seconds'), row.get('guild_renotify_seconds'), DEFAULT_RENOTIFY)
+        self.probe_kind = row.get('probe_kind')
+        self.probe_url = row.get('probe_url')
+        self.probe_interval = _seconds(row.get('probe_interval_seconds'), None)
+        self.probe_timeout = _seconds(row.get('probe_timeout_seconds'), None)
+        self.last_heartbeat = to_epoch(row.get('last_heartbeat'))
+        self.locale = row.get('guild_locale')
+        self.timezone = row.get('guild_timezone')
+
+    def heartbeat_deadline(self):
+        """この時刻(エポック秒)までに次のハートビートがなければ停止とみなします"""
+        if self.last_heartbeat is None:
+            return 0.0
+        return self.last_heartbeat + (self.probe_interval + (self.probe_timeout or timedelta())).total_seconds()
+
+    def heartbeat_alive(self, now):
+        return to_epoch(now) <= self.heartbeat_deadline()
+
+    def state_row(self):
+        # 比較用に軽量なエポック秒のまま返す。書き込み時に to_datetime で変換する
+        return (self.guild_id, self.bot_id, self.last_online, self.last_notified,
+                self.last_dm_notified, self.last_dm_online_notified,
+                self.last_channel_notified, self.last_channel_online_notified)
+
+
+def to_epoch(value):
+    """datetime(タイムゾーンなしはUTC)または ISO 形式の文字列をエポック秒に変換します"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        return value.timestamp()
+    return (value - EPOCH).total_seconds()
+
+
+def to_datetime(value):
+    """エポック秒をデータベースと同じタイムゾーンなしのUTCの datetime に変換します"""
+    if value is None:
+        return None
+    return EPOCH + timedelta(seconds=value)
+
+
+def _seconds(*values):
+    for value in values[:-1]:
+        if value is not None:
+            return _duration(value)
+    return values[-1]
+
+
+@functools.lru_cache(maxsize=1024)
+def _duration(seconds):
+    # 設定値の種類は少ないため、同じ秒数の timedelta は全てのBOTで共有する
+    return timedelta(seconds=seconds)
+
+
+class PresenceTracker:
+    """監視対象BOTごとのステータス遷移を管理するステートマシン
+
+    online -> offline_pending -> offline_notified -> online の順に遷移し、
+    猶予時間が過ぎた時点で on_offline、通知済みから復帰した時点で on_online を呼び出します。
+    on_change にはオンライン/オフラインが切り替わるたびに (bot, online, 時刻) が渡されます。
+    observe は判定元(source)ごとに呼び出し、すべての判定元が正常な場合のみオンラインとして扱います。
+    hold(bot) が True を返す間はオフライン通知を行わず、hold_retry 後に再判定します。
+    flaps を渡すと、短時間に切り替わりを繰り返すBOTを unstable にして on_unstable を1回だけ呼び出し、
+    安定するまで個別の通知を止めます。安定した時点でオンラインなら on_online、オフラインなら猶予時間から再開します。
+    """
+
+    def __init__(self, on_offline, on_online, grace=DEFAULT_GRACE, renotify=DEFAULT_RENOTIFY, on_change=None,
+                 hold=None, hold_retry=timedelta(minutes=1), flaps=None, on_unstable=None):
+        self.on_offline = on_offline
+        self.on_online = on_online
+        self.on_unstable = on_unstable
+        self.flaps = flaps
+        self.on_change = on_change
+        self.hold = hold
+        self.hold_retry = hold_retry
+        self.grace = grace
+        self.renotify = renotify
+        self.bots = {}
+        self.deadlines = DueScheduler()
+        self._runner = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self.bots)
+
+    def get(self, guild_id, bot_id):
+        return self.bots.get((guild_id, bot_id))
+
+    def grace_for(self, bot):
+        # 猶予時間0(即時通知)も有効な設定のため None の場合のみ既定値を使う
+        return bot.grace if bot.grace is not None else self.grace
+
+    def renotify_for(self, bot):
+        return bot.renotify if bot.renotify is not None else self.renotify
+
+    def track(self, bot):
+        current = self.bots.get(bot.key)
+        if current is not None:
+            return current
+        self.bots[bot.key] = bot
+        if bot.state is BotState.OFFLINE_NOTIFIED:
+            elapsed = timedelta(seconds=time.time() - (bot.last_notified or time.time()))
+            self._schedule(bot, max(self.renotify_for(bot) - elapsed, timedelta()))
+        elif bot.state is BotState.OFFLINE_PENDING:
+            # スナップショットから復元した猶予中のBOTは残りの猶予時間から再開する
+            elapsed = timedelta(seconds=time.time() - (bot.last_online or time.time()))
+            self._schedule(bot, max(self.grace_for(bot) - elapsed, timedelta()))
+        elif bot.state is BotState.UNSTABLE and self.flaps is not None:
+            self._schedule(bot, self.flaps.slot_length)
+        return bot
+
+    def untrack(self, guild_id, bot_id):
+        bot = self.bots.pop((guild_id, bot_id), None)
+        if bot is not None:
+            self._cancel(bot)
+        return bot
+
+    def observe(self, guild_id, bot_id, online, now=None, source='presence'):
+        bot = self.bots.get((guild_id, bot_id))
+        if bot is None:
+            return None
+        now = now or datetime.utcnow()
+        setattr(bot, SOURCES[source], online)
+        online = bot.sources_up()
+        if online != bot.online:
+            bot.online = online
+            if self.on_change is not None:
+                self.on_change(bot, online, now)
+            if self.flaps is not None and bot.state is not BotState.UNSTABLE \
+                    and self.flaps.is_flapping(self.flaps.record(bot, now)):
+                self._enter_unstable(bot)
+            elif self.flaps is not None and bot.state is BotState.UNSTABLE:
+                self.flaps.record(bot, now)
+        if bot.state is BotState.UNSTABLE:
+            return bot.state
+        if online:
+            if bot.state is BotState.OFFLINE_PENDING:
+                logging.debug("%s が猶予時間内に復帰しました。", bot.name)
+                self._cancel(bot)
+                bot.state = BotState.ONLINE
+            elif bot.state is BotState.OFFLINE_NOTIFIED:
+                self._cancel(bot)
+                bot.state = BotState.ONLINE
+                bot.last_notified = None
+                bot.last_online = to_epoch(now)
+                self._spawn(self.on_online(bot))
+        elif bot.state is BotState.ONLINE:
+            logging.debug("%s がオフラインになりました。通知まで %s 待機します。", bot.name, self.grace_for(bot))
+            bot.state = BotState.OFFLINE_PENDING
+            bot.last_online = to_epoch(now)
+            self._schedule(bot, self.grace_for(bot))
+        return bot.state
+
+    def clear_source(self, guild_id, bot_id, source):
+        bot = self.bots.get((guild_id, bot_id))
+        if bot is None or getattr(bot, SOURCES[source]) is None:
+            return
+        setattr(bot, SOURCES[source], None)
+        for remaining, name in SOURCES.items():
+            if getattr(bot, name) is not None:
+                self.observe(guild_id, bot_id, getattr(bot, name), source=remaining)
+                return
+
+    def close(self):
+        self.deadlines.clear()
+        if self._runner is not None:
+            self._runner.cancel()
+        for task in self._tasks:
+            task.cancel()
+
+    def _schedule(self, bot, delay):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self.deadlines.run(self._fire))
+        self.deadlines.schedule_in(bot.key, delay.total_seconds())
+
+    def _cancel(self, bot):
+        self.deadlines.cancel(bot.key)
+
+    def _enter_unstable(self, bot):
+        logging.info("%s が短時間にオンライン/オフラインを繰り返しています。", bot.name)
+        self._cancel(bot)
+        bot.state = BotState.UNSTABLE
+        if self.on_unstable is not None:
+            self._spawn(self.on_unstable(bot))
+        self._schedule(bot, self.flaps.slot_length)
+
+    def _settle(self, bot, now):
+        logging.info("%s の状態が安定しました。", bot.name)
+        if bot.online:
+            bot.state = BotState.ONLINE
+            bot.last_notified = None
+            bot.last_online = to_epoch(now)
+            self._spawn(self.on_online(bot))
+        else:
+            bot.state = BotState.OFFLINE_PENDING
+            bot.last_online = to_epoch(now)
+            self._schedule(bot, self.grace_for(bot))
+
+    def _fire(self, key):
+        bot = self.bots.get(key)
+        if bot is None or bot.state is BotState.ONLINE:
+            return
+        if bot.state is BotState.UNSTABLE:
+            now = datetime.utcnow()
+            if self.flaps.is_settled(self.flaps.score(bot, now)):
+                self._settle(bot, now)
+            else:
+                self._schedule(bot, self.flaps.slot_length)
+            return
+        if self.hold is not None and self.hold(bot):
+            self._schedule(bot, self.hold_retry)
+            return
+        bot.state = BotState.OFFLINE_NOTIFIED
+        bot.last_notified = time.time()
+        self._spawn(self.on_offline(bot))
+        self._schedule(bot, self.renotify_for(bot))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,112 @@
+import discord
+
+import asyncio
+import logging
+import random
+
+from utils import api
+from utils.metrics import NOTIFY_FAILURES, NOTIFY_SECONDS
+
+
+class NotificationDispatcher:
+    """通知の送信キュー
+
+    送信先(チャンネル/ユーザー/Webhook)ごとにキューを持ち、同じ送信先への通知は1つのメッセージに
+    最大10個のEmbedとしてまとめて送信します。送信先ごとの同時送信数は1、全体の同時送信数は
+    max_concurrency までに制限し、5xx/429 の場合はバックオフしながら再送します。
+    """
+
+    MAX_EMBEDS = 10
+
+    def __init__(self, bot, max_concurrency=16, coalesce_delay=0.5, max_retries=3, base_delay=1.0):
+        self.bot = bot
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = {}
+        self._workers = {}
+
+    def send_channel(self, channel_id, embed):
+        return self._enqueue(('channel', channel_id), embed)
+
+    def send_dm(self, user_id, embed):
+        return self._enqueue(('user', user_id), embed)
+
+    def send_webhook(self, url, embed):
+        # WebhookはBOTのレート制限を消費しないため、チャンネルへの送信より安価
+        return self._enqueue(('webhook', url), embed)
+
+    async def close(self):
+        # 未送信の通知を送り切ってから終了する
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def _enqueue(self, route, embed):
+        """送信完了時に True、失敗時に False となる Future を返します"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(route, []).append((embed, future))
+        if route not in self._workers:
+            self._workers[route] = asyncio.create_task(self._drain(route))
+        return future
+
+    async def _drain(self, route):
+        batch = []
+        try:
+            await asyncio.sleep(self.coalesce_delay)
+            while self._pending.get(route):
+                queue = self._pending[route]
+                batch, self._pending[route] = queue[:self.MAX_EMBEDS], queue[self.MAX_EMBEDS:]
+                delivered = await self._deliver(route, [embed for embed, _ in batch])
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(delivered)
+        finally:
+            # 送信中に中断された分も含め、結果の出ていない Future は失敗として解決する
+            for _, future in batch + self._pending.pop(route, []):
+                if not future.done():
+                    future.set_result(False)
+            self._workers.pop(route, None)
+
+    async def _deliver(self, route, embeds):
+        latency = NOTIFY_SECONDS.labels(kind=route[0])
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    with latency.time():
+                        target = await self._resolve(route)
+                        await target.send(embeds=embeds)
+                return True
+            except discord.HTTPException as e:
+                if (e.status < 500 and e.status != 429) or attempt >= self.max_retries:
+                    logging.error("通知の送信に失敗しました: %s %s", _describe(route), e)
+                    break
+                logging.warning("通知の送信に失敗しました。再送します: %s %s", _describe(route), e)
+            except (discord.ClientException, asyncio.TimeoutError, OSError) as e:
+                if attempt >= self.max_retries:
+                    logging.error("通知の送信に失敗しました: %s %s", _describe(route), e)
+                    break
+            except Exception as e:
+                # 送信できない種類のチャンネルや不正なWebhookのURLなど、再送しても成功しないもの
+                logging.error("通知の送信に失敗しました: %s %r", _describe(route), e)
+                break
+            await asyncio.sleep(self.base_delay * 2 ** attempt + random.uniform(0, self.base_delay))
+        NOTIFY_FAILURES.labels(kind=route[0]).inc()
+        return False
+
+    async def _resolve(self, route):
+        kind, target_id = route
+        if kind == 'webhook':
+            return discord.Webhook.from_url(target_id, session=api.http.session)
+        if kind == 'channel':
+            return self.bot.get_channel(target_id) or await self.bot.fetch_channel(target_id)
+        user = self.bot.get_user(target_id) or await self.bot.fetch_user(target_id)
+        return user.dm_channel or await user.create_dm()
+
+
+def _describe(route):
+    # WebhookのURLにはトークンが含まれるためログには出さない
+    kind, target = route
+    if kind == 'webhook':
+        return (kind, target.rsplit('/', 2)[-2] if target.count('/') >= 2 else '?')
+    return route
@@ -16,7 +16,7 @@ presences = [
 async def update_presence(bot):
     index = 0
     while not bot.is_closed():
-        member_count = sum(1 for _ in bot.get_guild(main_guild_id).members)
+        member_count = bot.get_guild(main_guild_id).member_count
         
         custom_presence = {"type": "Playing", "name": f"{member_count}人が参加中...", "state": "iPhoneだけだよ！"}
         presences[-1] = custom_presence
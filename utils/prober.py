@@ -0,0 +1,136 @@
+import aiohttp
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from urllib.parse import urlsplit
+
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import DefaultResolver
+
+from utils.api import HttpClient
+from utils.metrics import HEARTBEATS, PROBE_SECONDS
+
+
+class UnsafeAddressError(OSError):
+    pass
+
+
+def is_public_address(address):
+    """グローバルに到達可能なユニキャストアドレスかどうか。ループバック・プライベート・リンクローカル等は偽"""
+    try:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+    except ValueError:
+        return False
+    if getattr(ip, 'ipv4_mapped', None) is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class PublicResolver(AbstractResolver):
+    """名前解決の結果から内部ネットワークのアドレスを取り除くリゾルバ
+
+    接続の直前に毎回判定するため、登録後にDNSの応答を内部アドレスへ変える(DNSリバインディング)ことはできません。
+    """
+
+    def __init__(self):
+        self._resolver = DefaultResolver()
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        hosts = [info for info in await self._resolver.resolve(host, port, family) if is_public_address(info['host'])]
+        if not hosts:
+            raise UnsafeAddressError(f"{host} は内部ネットワークのアドレスです。")
+        return hosts
+
+    async def close(self):
+        await self._resolver.close()
+
+
+async def validate_url(url):
+    """ヘルスチェックに使えるURLかを確認し、問題があれば理由を返します"""
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        return "URLの形式が正しくありません。"
+    if parts.scheme not in ('http', 'https') or not host:
+        return "http:// または https:// で始まるURLを指定してください。"
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port or 80, type=socket.SOCK_STREAM)
+    except OSError:
+        return f"{host} の名前解決に失敗しました。"
+    if not infos or not all(is_public_address(info[4][0]) for info in infos):
+        return "内部ネットワークやループバックのアドレスは指定できません。"
+    return None
+
+
+class HttpProber:
+    """監視対象BOTのヘルスチェックURLへ並行してリクエストを送ります
+
+    専用のキープアライブ接続プールを使い、全体の同時実行数とホストごとの同時実行数(コネクタの limit_per_host)を
+    制限します。接続先は PublicResolver で毎回確認し、内部ネットワークへは接続しません。2xx/3xx の応答を正常とみなします。
+    """
+
+    def __init__(self, max_concurrency=1000, per_host=8, timeout=10):
+        self.client = HttpClient(limit=max_concurrency, limit_per_host=per_host, timeout=timeout, resolver=PublicResolver())
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def check(self, url, timeout=None):
+        # IPアドレスを直接指定したURLはリゾルバを通らないため、ここで確認する
+        host = urlsplit(url).hostname or ''
+        if _is_ip(host) and not is_public_address(host):
+            logging.debug("内部ネットワークへのヘルスチェックを拒否しました: %s", url)
+            PROBE_SECONDS.labels(result='error').observe(0)
+            return False
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                async with self.client.session.get(url, allow_redirects=False,
+                                                   timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)) as resp:
+                    ok = resp.status < 400
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, OSError) as e:
+                logging.debug("ヘルスチェックに失敗しました: %s %s", url, e)
+                ok = False
+            PROBE_SECONDS.labels(result='ok' if ok else 'error').observe(time.perf_counter() - start)
+            return ok
+
+    async def close(self):
+        await self.client.close()
+
+
+def _is_ip(host):
+    try:
+        ipaddress.ip_address(host.split('%', 1)[0])
+    except ValueError:
+        return False
+    return True
+
+
+async def start_heartbeat_server(port, on_beat, host='0.0.0.0'):
+    """/heartbeat/{token} へのリクエストを受け付けるHTTPサーバーを起動します
+
+    on_beat(token) が登録済みのトークンなら真を返します。複数のワーカーで同じポートを共有できるよう
+    reuse_port を有効にしています。
+    """
+    async def handle_heartbeat(request):
+        try:
+            accepted = await on_beat(request.match_info['token'])
+        except Exception:
+            logging.exception("ハートビートの記録に失敗しました。")
+            HEARTBEATS.labels(result='error').inc()
+            return web.Response(status=503)
+        HEARTBEATS.labels(result='ok' if accepted else 'unknown').inc()
+        return web.Response(status=204 if accepted else 404)
+
+    app = web.Application()
+    app.router.add_route('GET', '/heartbeat/{token}', handle_heartbeat)
+    app.router.add_route('POST', '/heartbeat/{token}', handle_heartbeat)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=True)
+    await site.start()
+    logging.info("ハートビートの受付を開始しました: http://%s:%d/heartbeat/", host, port)
+    return runner
@@ -0,0 +1,136 @@
+import bisect
+
+
+class NameIndex:
+    """名前の前方一致/部分一致検索用のインデックス
+
+    小文字化した名前をソート済みリストで保持し、前方一致は二分探索、部分一致は
+    事前に小文字化した名前の走査で求めます。
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, item_id):
+        return item_id in self._names
+
+    def add(self, item_id, name):
+        self.remove(item_id)
+        lower = name.lower()
+        self._names[item_id] = (name, lower)
+        bisect.insort(self._sorted, (lower, item_id))
+
+    def remove(self, item_id):
+        entry = self._names.pop(item_id, None)
+        if entry is None:
+            return
+        i = bisect.bisect_left(self._sorted, (entry[1], item_id))
+        if i < len(self._sorted) and self._sorted[i][1] == item_id:
+            del self._sorted[i]
+
+    def search(self, query, limit=25, predicate=None):
+        """前方一致 → 部分一致の順に (id, name) を最大 limit 件返します"""
+        query = query.lower()
+        results = []
+        seen = set()
+        i = bisect.bisect_left(self._sorted, (query,))
+        prefixed = []
+        while i < len(self._sorted) and self._sorted[i][0].startswith(query):
+            lower, item_id = self._sorted[i]
+            if predicate is None or predicate(item_id):
+                prefixed.append((len(lower), lower, item_id))
+            i += 1
+        for _, _, item_id in sorted(prefixed)[:limit]:
+            results.append((item_id, self._names[item_id][0]))
+            seen.add(item_id)
+        if len(results) >= limit or not query:
+            return results
+
+        contained = []
+        for item_id, (name, lower) in self._names.items():
+            if item_id in seen:
+                continue
+            position = lower.find(query)
+            if position > 0 and (predicate is None or predicate(item_id)):
+                contained.append((position, len(lower), lower, item_id))
+        for _, _, _, item_id in sorted(contained)[:limit - len(results)]:
+            results.append((item_id, self._names[item_id][0]))
+        return results
+
+
+class GuildRegistry:
+    def __init__(self):
+        self.members = NameIndex()
+        self.registered = NameIndex()
+        self.owners = {}
+        self.members_loaded = False
+        # ゲートウェイで検索済みかつ結果が上限未満だった(全件取得できた)クエリ
+        self.searched = set()
+
+    def search_members(self, query, limit=25):
+        return self.members.search(query, limit)
+
+    def needs_search(self, query):
+        query = query.lower()
+        return not any(query.startswith(searched) for searched in self.searched)
+
+    def mark_searched(self, query):
+        self.searched.add(query.lower())
+
+    def search_registered(self, query, user_id=None, limit=25):
+        if user_id is None:
+            return self.registered.search(query, limit)
+        return self.registered.search(query, limit, predicate=lambda bot_id: self.owners.get(bot_id) == user_id)
+
+
+class RegistryCache:
+    """ギルドごとの登録済みBOTとBOTメンバーのキャッシュ
+
+    オートコンプリートをDBやメンバー一覧の走査なしでメモリから応答するために使用します。
+    """
+
+    def __init__(self):
+        self.guilds = {}
+
+    def guild(self, guild):
+        registry = self.guilds.get(guild.id)
+        if registry is None:
+            registry = self.guilds[guild.id] = GuildRegistry()
+        if not registry.members_loaded:
+            for member in guild.members:
+                if member.bot:
+                    registry.members.add(member.id, member.name)
+            registry.members_loaded = True
+        return registry
+
+    def drop_guild(self, guild_id):
+        self.guilds.pop(guild_id, None)
+
+    def add_member(self, member):
+        registry = self.guilds.get(member.guild.id)
+        if registry is not None and member.bot:
+            registry.members.add(member.id, member.name)
+            if member.id in registry.registered:
+                registry.registered.add(member.id, member.name)
+
+    def remove_member(self, member):
+        registry = self.guilds.get(member.guild.id)
+        if registry is not None:
+            registry.members.remove(member.id)
+
+    def register(self, guild_id, bot_id, user_id, name):
+        registry = self.guilds.get(guild_id)
+        if registry is None:
+            registry = self.guilds[guild_id] = GuildRegistry()
+        registry.registered.add(bot_id, name)
+        registry.owners[bot_id] = user_id
+
+    def unregister(self, guild_id, bot_id):
+        registry = self.guilds.get(guild_id)
+        if registry is not None:
+            registry.registered.remove(bot_id)
+            registry.owners.pop(bot_id, None)
@@ -0,0 +1,168 @@
+import discord
+
+import functools
+import logging
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from utils.correlation import GLOBAL
+
+DEFAULT_LOCALE = 'ja'
+DEFAULT_TIMEZONE = 'Asia/Tokyo'
+
+MESSAGES = {
+    'ja': {
+        'offline.title': 'BOTがオフラインになりました。',
+        'offline.description': '{name}がオフラインになって{grace}が経過しました。',
+        'offline.since': 'オフライン時間',
+        'online.title': 'BOTがオンラインになりました。',
+        'online.description': '{name}がオンラインになりました。',
+        'online.since': 'オンライン時間',
+        'unstable.title': 'BOTの状態が不安定です。',
+        'unstable.description': '{name}が短時間にオンライン/オフラインを繰り返しています。\n状態が安定するまで個別の通知を停止します。',
+        'unstable.since': '検知時刻',
+        'bot.field': 'BOT情報',
+        'bot.info': 'ID: {id}\n名前: {name}',
+        'incident.title': '障害を検知しました。',
+        'incident.description': '{scope}で{count}件のBOTが短時間にオフラインになりました。\nDiscord側の障害の可能性があるため、個別の通知を保留します。',
+        'incident_resolved.title': '障害が収束しました。',
+        'incident_resolved.description': '{scope}で検知していた障害が収束しました。\n影響を受けたBOT: {count}件',
+        'incident_resolved.footer': 'まだオフラインのBOTには個別に通知します。',
+        'incident.started': '検知時刻',
+        'scope.global': '全体',
+        'scope.shard': 'シャード{shard}',
+        'duration.seconds': '{value}秒',
+        'duration.minutes': '{value}分',
+        'footer.time': '{time} ({zone})',
+    },
+    'en': {
+        'offline.title': 'Bot went offline.',
+        'offline.description': '{name} has been offline for {grace}.',
+        'offline.since': 'Offline since',
+        'online.title': 'Bot is back online.',
+        'online.description': '{name} is back online.',
+        'online.since': 'Online since',
+        'unstable.title': 'Bot is unstable.',
+        'unstable.description': '{name} keeps going online and offline.\nIndividual alerts are paused until it settles.',
+        'unstable.since': 'Detected at',
+        'bot.field': 'Bot',
+        'bot.info': 'ID: {id}\nName: {name}',
+        'incident.title': 'Outage detected.',
+        'incident.description': '{count} bots went offline at once ({scope}).\nThis may be a Discord outage, so individual alerts are on hold.',
+        'incident_resolved.title': 'Outage resolved.',
+        'incident_resolved.description': 'The outage detected for {scope} is over.\nAffected bots: {count}',
+        'incident_resolved.footer': 'Bots that are still offline will be alerted individually.',
+        'incident.started': 'Detected at',
+        'scope.global': 'all shards',
+        'scope.shard': 'shard {shard}',
+        'duration.seconds': '{value} seconds',
+        'duration.minutes': '{value} minutes',
+        'footer.time': '{time} ({zone})',
+    },
+}
+
+COLORS = {
+    'offline': discord.Color.red(),
+    'online': discord.Color.green(),
+    'unstable': discord.Color.gold(),
+    'incident': discord.Color.orange(),
+    'incident_resolved': discord.Color.green(),
+}
+
+
+def messages(locale):
+    return MESSAGES.get(locale) or MESSAGES[DEFAULT_LOCALE]
+
+
+def text(locale, key, **values):
+    return messages(locale)[key].format(**values)
+
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        logging.warning("タイムゾーンが見つかりません: %s", name)
+        return timezone(timedelta(hours=9), 'JST')
+
+
+def is_valid_zone(name):
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def format_duration(delta, locale=DEFAULT_LOCALE):
+    seconds = int(delta.total_seconds())
+    if seconds < 60:
+        return text(locale, 'duration.seconds', value=seconds)
+    return text(locale, 'duration.minutes', value=seconds // 60)
+
+
+def unix(value):
+    # 監視中のBOTの時刻はエポック秒、DB上の時刻はタイムゾーンなしのUTCで保持している
+    if isinstance(value, (int, float)):
+        return int(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+class Template:
+    """イベントと言語ごとに固定の文言・色をまとめたEmbedの雛形"""
+
+    def __init__(self, event, locale):
+        self.event = event
+        self.locale = locale
+        self.title = text(locale, f'{event}.title')
+        self.description = messages(locale)[f'{event}.description']
+        self.color = COLORS[event]
+
+    def render(self, now, zone, fields=(), footer=None, **values):
+        e = discord.Embed(title=self.title, description=self.description.format(**values), color=self.color, timestamp=now)
+        for name, value in fields:
+            e.add_field(name=name, value=value)
+        local = now.astimezone(zone)
+        time_text = text(self.locale, 'footer.time', time=local.strftime('%Y/%m/%d %H:%M'), zone=local.tzname())
+        e.set_footer(text=f"{footer}\n{time_text}" if footer else time_text)
+        return e
+
+
+@functools.lru_cache(maxsize=64)
+def template(event, locale):
+    return Template(event, locale)
+
+
+@functools.lru_cache(maxsize=4096)
+def bot_info(locale, bot_id, name):
+    # BOTごとに変わらない行はキャッシュし、遷移ごとには時刻の行だけを組み立てる
+    return text(locale, 'bot.info', id=bot_id, name=name)
+
+
+def render_status(event, monitored, name, grace=None, now=None):
+    """オフライン/オンライン/不安定の通知のEmbedを1回だけ組み立てます。全ての送信先で同じものを使います"""
+    locale = monitored.locale or DEFAULT_LOCALE
+    now = now or datetime.now(timezone.utc)
+    since = unix(now if event == 'unstable' else monitored.last_online or now)
+    values = {'name': name}
+    if event == 'offline':
+        values['grace'] = format_duration(grace, locale)
+    info = f"{bot_info(locale, monitored.bot_id, name)}\n{text(locale, f'{event}.since')}: <t:{since}:F> | <t:{since}:R>"
+    return template(event, locale).render(now, get_zone(monitored.timezone), fields=[(text(locale, 'bot.field'), info)], **values)
+
+
+def render_incident(incident, resolved=False, locale=DEFAULT_LOCALE, zone_name=None, now=None):
+    event = 'incident_resolved' if resolved else 'incident'
+    now = now or datetime.now(timezone.utc)
+    if incident.scope == GLOBAL:
+        scope = text(locale, 'scope.global')
+    else:
+        scope = text(locale, 'scope.shard', shard=incident.scope)
+    started = unix(incident.started_at)
+    fields = [(text(locale, 'incident.started'), f"<t:{started}:F> | <t:{started}:R>")]
+    footer = text(locale, 'incident_resolved.footer') if resolved else None
+    return template(event, locale).render(now, get_zone(zone_name), fields=fields, footer=footer,
+                                          scope=scope, count=len(incident.affected))
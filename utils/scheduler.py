@@ -0,0 +1,73 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class DueScheduler:
+    """次回実行時刻をキーにしたヒープによるスケジューラ
+
+    キーごとに次回実行時刻を1つだけ保持し、再スケジュールやキャンセルで古くなった
+    ヒープの要素は取り出し時に読み捨てます。時刻は time.monotonic() 基準の秒数です。
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, key):
+        return key in self._due
+
+    def schedule(self, key, due):
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._counter), key))
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._compact()
+        self._wakeup.set()
+
+    def schedule_in(self, key, delay):
+        self.schedule(key, time.monotonic() + delay)
+
+    def cancel(self, key):
+        self._due.pop(key, None)
+
+    def clear(self):
+        self._heap.clear()
+        self._due.clear()
+
+    def next_due(self):
+        while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        due_keys = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, key = heapq.heappop(self._heap)
+            if self._due.get(key) == due:
+                del self._due[key]
+                due_keys.append(key)
+        return due_keys
+
+    async def run(self, callback):
+        """期限が来たキーごとに callback(key) を呼び出し続けます"""
+        while True:
+            self._wakeup.clear()
+            for key in self.pop_due():
+                callback(key)
+            next_due = self.next_due()
+            timeout = None if next_due is None else max(next_due - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _compact(self):
+        self._heap = [(due, next(self._counter), key) for key, due in self._due.items()]
+        heapq.heapify(self._heap)
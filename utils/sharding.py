@@ -0,0 +1,61 @@
+import logging
+import os
+import socket
+import time
+
+
+def parse_shard_ids(value):
+    """'0-3,8' のような指定をシャードIDのリストに変換します"""
+    if not value:
+        return None
+    shard_ids = []
+    for part in value.split(','):
+        start, _, end = part.strip().partition('-')
+        shard_ids.extend(range(int(start), int(end or start) + 1))
+    return shard_ids
+
+
+def default_worker_id():
+    return os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardLeaseManager:
+    """シャード単位のリースをDB上で管理し、各シャードを1つのワーカーだけが評価するようにします
+
+    リースは ttl 秒で失効するため、ワーカーが落ちて再起動した場合(ワーカーIDが変わる場合を含む)も、
+    失効後に同じシャードに接続したワーカーが取得し直せます。各ワーカーは SHARD_IDS のシャードにしか
+    接続しないため、他のワーカーが落ちたワーカーのシャードを引き継ぐことはありません。
+    ローカルでも失効時刻を保持し、更新に失敗し続けた場合は評価を止めます。
+    """
+
+    def __init__(self, db, worker_id=None, ttl=60):
+        self.db = db
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self.owned = set()
+        self.expires = 0.0
+
+    def owns(self, shard_id):
+        return shard_id in self.owned and time.monotonic() < self.expires
+
+    async def renew(self, shard_ids):
+        query = """
+        INSERT INTO shard_leases (shard_id, worker_id, expires_at)
+        SELECT shard_id, %s, now() + %s * interval '1 second' FROM unnest(%s::int[]) AS shard_id
+        ON CONFLICT (shard_id) DO UPDATE SET worker_id = EXCLUDED.worker_id, expires_at = EXCLUDED.expires_at
+        WHERE shard_leases.worker_id = EXCLUDED.worker_id OR shard_leases.expires_at < now()
+        RETURNING shard_id;
+        """
+        renewed_at = time.monotonic()
+        result = await self.db.execute(query, (self.worker_id, self.ttl, list(shard_ids)), commit=True)
+        owned = {row[0] for row in result or ()}
+        if owned != self.owned:
+            logging.info("シャードのリースを更新しました: %s (%s)", sorted(owned), self.worker_id)
+        self.owned = owned
+        self.expires = renewed_at + self.ttl
+        return owned
+
+    async def release(self):
+        query = "DELETE FROM shard_leases WHERE worker_id = %s;"
+        await self.db.execute(query, (self.worker_id,), commit=True)
+        self.owned = set()
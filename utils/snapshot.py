@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+
+from utils.monitor import BotState
+
+
+class MonitorSnapshot:
+    """再起動をまたいで監視状態を引き継ぐためのスナップショット
+
+    終了時にBOTごとの状態(猶予中・通知済み・不安定、最終オンライン時刻、フラップの履歴)と
+    シャードのセッションIDをファイルに保存し、起動時に max_age 以内のものだけを復元します。
+    データベースには通知済みかどうかしか残らないため、猶予中や不安定の状態はこのファイルからのみ復元できます。
+    """
+
+    def __init__(self, path, max_age=timedelta(minutes=15)):
+        self.path = path
+        self.max_age = max_age
+        self.bots = {}
+        self.sessions = {}
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logging.warning("スナップショットを読み込めませんでした: %s", e)
+            return False
+        age = time.time() - data.get('saved_at', 0)
+        if age > self.max_age.total_seconds():
+            logging.info("スナップショットが古いため使用しません(%d秒前)。", age)
+            return False
+        self.bots = {(guild_id, bot_id): entry for guild_id, bot_id, *entry in data.get('bots', ())}
+        self.sessions = {int(shard_id): session for shard_id, session in data.get('sessions', {}).items()}
+        logging.info("スナップショットを読み込みました: %d件", len(self.bots))
+        return True
+
+    def save(self, bots, sessions):
+        data = {
+            'saved_at': time.time(),
+            'bots': [_dump(bot) for bot in bots],
+            'sessions': {str(shard_id): session for shard_id, session in sessions.items()},
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning("スナップショットを保存できませんでした: %s", e)
+            return False
+        logging.info("スナップショットを保存しました: %d件", len(data['bots']))
+        return True
+
+    def restore(self, bot):
+        """データベースから読み込んだBOTにスナップショットの状態を上書きします。track の前に呼び出してください"""
+        entry = self.bots.pop(bot.key, None)
+        if entry is None:
+            return False
+        state, online, last_online, last_notified, flap_bits, flap_slot = entry
+        bot.state = BotState(state)
+        bot.online = online
+        bot.last_online = last_online
+        bot.last_notified = last_notified
+        bot.flap_bits = flap_bits
+        bot.flap_slot = flap_slot
+        return True
+
+
+def _dump(bot):
+    return [bot.guild_id, bot.bot_id, bot.state.value, bot.online, bot.last_online,
+            bot.last_notified, bot.flap_bits, bot.flap_slot]
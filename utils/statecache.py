@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+from utils.monitor import to_datetime
+
+
+class StateCache:
+    """監視中BOTの状態のライトビハインドキャッシュ
+
+    メモリ上の MonitoredBot を正とし、状態遷移があったBOTだけを dirty として記録します。
+    flush では最後に書き込んだ内容と比較し、変化した列だけを save(last_online の行, 通知状態の行, 通知の行) で
+    まとめて書き込みます。定期的な flush の間隔が、クラッシュ時に失われうる遷移の上限になります。
+    enqueue した通知は状態と同じ save 呼び出し(同じトランザクション)で書き込まれます。
+    """
+
+    def __init__(self, save, max_dirty=500):
+        self.save = save
+        self.max_dirty = max_dirty
+        self.dirty = {}
+        self.persisted = {}
+        self.outbox = []
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.dirty)
+
+    def remember(self, bot):
+        """データベースから読み込んだ時点の状態を書き込み済みとして記録します"""
+        self.persisted[bot.key] = bot.state_row()
+
+    def forget(self, key):
+        self.persisted.pop(key, None)
+
+    def mark(self, bot):
+        """状態が変わったBOTを記録し、溜まりすぎている場合は True を返します"""
+        self.dirty[bot.key] = bot
+        return len(self.dirty) >= self.max_dirty
+
+    def enqueue(self, bot, rows):
+        """BOTの状態遷移と一緒に書き込む通知の行を追加します"""
+        self.dirty[bot.key] = bot
+        self.outbox.extend(rows)
+
+    async def flush(self):
+        async with self._lock:
+            if not self.dirty and not self.outbox:
+                return 0
+            dirty, self.dirty = self.dirty, {}
+            outbox, self.outbox = self.outbox, []
+            rows = {key: bot.state_row() for key, bot in dirty.items()}
+            online_rows = []
+            notification_rows = []
+            for key, row in rows.items():
+                previous = self.persisted.get(key)
+                if previous is None or row[2] != previous[2]:
+                    online_rows.append(row[:2] + (to_datetime(row[2]),))
+                if previous is None or row[3:] != previous[3:]:
+                    notification_rows.append(row[:2] + tuple(to_datetime(value) for value in row[3:]))
+            if not online_rows and not notification_rows and not outbox:
+                return 0
+            try:
+                await self.save(online_rows, notification_rows, outbox)
+            except Exception:
+                for key, bot in dirty.items():
+                    self.dirty.setdefault(key, bot)
+                self.outbox[:0] = outbox
+                raise
+            for key, row in rows.items():
+                if key in self.persisted:
+                    self.persisted[key] = row
+            logging.debug("BOTの状態を書き込みました: last_online %d件 / 通知状態 %d件 / 通知 %d件",
+                          len(online_rows), len(notification_rows), len(outbox))
+            return len(rows) + len(outbox)
@@ -0,0 +1,70 @@
+from collections import namedtuple
+
+Subscription = namedtuple('Subscription', ['guild_id', 'bot_id', 'kind', 'target'])
+
+KINDS = ('channel', 'user', 'webhook')
+
+
+class SubscriptionIndex:
+    """bot_id から通知先への転置インデックス
+
+    1回の状態遷移につき1回の辞書参照で、そのギルドの全ての通知先を取り出せます。
+    target はチャンネル/ユーザーならID(int)、WebhookならそのURLです。
+    """
+
+    def __init__(self):
+        self.by_bot = {}
+        # 1ギルドの同期で全BOTを走査しないよう、ギルドごとに購読を持つBOTを記録する
+        self.by_guild = {}
+
+    def __len__(self):
+        return sum(len(subscriptions) for subscriptions in self.by_bot.values())
+
+    def add(self, subscription):
+        self.by_bot.setdefault(subscription.bot_id, set()).add(subscription)
+        self.by_guild.setdefault(subscription.guild_id, set()).add(subscription.bot_id)
+
+    def remove(self, subscription):
+        subscriptions = self.by_bot.get(subscription.bot_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.by_bot[subscription.bot_id]
+        if not self.targets(subscription.guild_id, subscription.bot_id):
+            self._forget(subscription.guild_id, subscription.bot_id)
+
+    def replace_guilds(self, guild_ids, rows):
+        """指定したギルドの購読をデータベースの行で置き換えます。対象ギルドに購読を持つBOTだけを更新します"""
+        guild_ids = set(guild_ids)
+        for guild_id in guild_ids:
+            for bot_id in self.by_guild.pop(guild_id, ()):
+                subscriptions = self.by_bot.get(bot_id)
+                if subscriptions is None:
+                    continue
+                kept = {subscription for subscription in subscriptions if subscription.guild_id != guild_id}
+                if kept:
+                    self.by_bot[bot_id] = kept
+                else:
+                    del self.by_bot[bot_id]
+        for row in rows:
+            self.add(from_row(row))
+
+    def drop_guild(self, guild_id):
+        self.replace_guilds((guild_id,), ())
+
+    def _forget(self, guild_id, bot_id):
+        bot_ids = self.by_guild.get(guild_id)
+        if bot_ids is None:
+            return
+        bot_ids.discard(bot_id)
+        if not bot_ids:
+            del self.by_guild[guild_id]
+
+    def targets(self, guild_id, bot_id):
+        return [subscription for subscription in self.by_bot.get(bot_id, ()) if subscription.guild_id == guild_id]
+
+
+def from_row(row):
+    target = row['target'] if row['kind'] == 'webhook' else int(row['target'])
+    return Subscription(row['guild_id'], row['bot_id'], row['kind'], target)
@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+
+FIELDS = ('bot_id', 'name', 'user_id', 'grace_seconds', 'check_interval_seconds', 'renotify_seconds', 'channels')
+MAX_ROWS = 5000
+# /config と同じ範囲(秒)。範囲外の値は即時の再通知やスケジューラの空回りを起こすため取り込まない
+SETTING_RANGES = {
+    'grace_seconds': (0, 1440 * 60),
+    'check_interval_seconds': (10, 3600),
+    'renotify_seconds': (60, 1440 * 60),
+}
+
+
+class TransferError(ValueError):
+    pass
+
+
+def dump_rows(rows, fmt):
+    """登録内容を JSON または CSV の bytes に変換します。channels はチャンネルIDのリストです"""
+    if fmt == 'json':
+        return json.dumps([{field: row.get(field) for field in FIELDS} for row in rows], ensure_ascii=False, indent=2).encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    for row in rows:
+        record = {field: row.get(field) for field in FIELDS}
+        record['channels'] = ' '.join(str(channel_id) for channel_id in row.get('channels') or ())
+        writer.writerow(record)
+    return buffer.getvalue().encode('utf-8')
+
+
+def load_rows(data, fmt):
+    """JSON または CSV を検証済みの行のリストに変換します。不正な内容は TransferError を送出します"""
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise TransferError("ファイルはUTF-8で保存してください。")
+    if fmt == 'json':
+        try:
+            records = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise TransferError(f"JSONの形式が正しくありません: {e}")
+        if not isinstance(records, list):
+            raise TransferError("JSONはオブジェクトの配列にしてください。")
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+    if len(records) > MAX_ROWS:
+        raise TransferError(f"一度に取り込めるのは{MAX_ROWS}件までです。")
+    return [_validate(index, record) for index, record in enumerate(records, start=1)]
+
+
+def _validate(index, record):
+    if not isinstance(record, dict):
+        raise TransferError(f"{index}行目: 形式が正しくありません。")
+    try:
+        row = {
+            'bot_id': int(record['bot_id']),
+            'name': str(record.get('name') or ''),
+            'user_id': _optional_int(record.get('user_id')),
+            'grace_seconds': _optional_int(record.get('grace_seconds')),
+            'check_interval_seconds': _optional_int(record.get('check_interval_seconds')),
+            'renotify_seconds': _optional_int(record.get('renotify_seconds')),
+        }
+        channels = record.get('channels') or []
+        if isinstance(channels, str):
+            channels = channels.split()
+        row['channels'] = [int(channel_id) for channel_id in channels]
+    except (KeyError, TypeError, ValueError):
+        raise TransferError(f"{index}行目: bot_id などの値が正しくありません。")
+    for field, (low, high) in SETTING_RANGES.items():
+        if row[field] is not None and not low <= row[field] <= high:
+            raise TransferError(f"{index}行目: {field} は{low}〜{high}の範囲で指定してください。")
+    return row
+
+
+def _optional_int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
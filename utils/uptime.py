@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def floor_hour(t):
+    return t.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(t):
+    return t.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ceil_day(t):
+    day = floor_day(t)
+    return day if day == t else day + DAY
+
+
+def rollup_hours(events, initial, start, end):
+    """ステータス遷移ログを1時間ごとの集計に変換します
+
+    events は {(guild_id, bot_id): [(occurred_at, online), ...]} (時刻順)、
+    initial は start 時点の状態 {(guild_id, bot_id): (online, since)} です。
+    (guild_id, bot_id, bucket, online_seconds, offline_seconds, outages, recoveries, repair_seconds)
+    のリストを返します。
+    """
+    rows = []
+    for key in set(events) | set(initial):
+        state = initial.get(key)
+        pending = events.get(key, ())
+        i = 0
+        bucket = start
+        while bucket < end:
+            bucket_end = bucket + HOUR
+            online_seconds = offline_seconds = repair_seconds = 0.0
+            outages = recoveries = 0
+            cursor = bucket
+            while i < len(pending) and pending[i][0] < bucket_end:
+                at, online = pending[i]
+                i += 1
+                if state is None:
+                    state = (online, at)
+                    cursor = at
+                    continue
+                elapsed = (at - cursor).total_seconds()
+                if state[0]:
+                    online_seconds += elapsed
+                else:
+                    offline_seconds += elapsed
+                cursor = at
+                if state[0] == online:
+                    continue
+                if online:
+                    recoveries += 1
+                    repair_seconds += (at - state[1]).total_seconds()
+                else:
+                    outages += 1
+                state = (online, at)
+            if state is not None:
+                elapsed = (bucket_end - cursor).total_seconds()
+                if state[0]:
+                    online_seconds += elapsed
+                else:
+                    offline_seconds += elapsed
+                rows.append((key[0], key[1], bucket, online_seconds, offline_seconds,
+                             outages, recoveries, repair_seconds))
+            bucket = bucket_end
+    return rows
+
+
+def split_window(start, end):
+    """日次集計で賄える範囲 [day_start, day_end) と、その前後の時間単位の範囲に分割します"""
+    day_start, day_end = ceil_day(start), floor_day(end)
+    if day_start >= day_end:
+        day_start = day_end = end
+    return day_start, day_end
+
+
+class UptimeStats:
+    def __init__(self, online_seconds, offline_seconds, outages, recoveries, repair_seconds):
+        self.online_seconds = online_seconds
+        self.offline_seconds = offline_seconds
+        self.outages = outages
+        self.recoveries = recoveries
+        self.repair_seconds = repair_seconds
+
+    @property
+    def observed_seconds(self):
+        return self.online_seconds + self.offline_seconds
+
+    @property
+    def uptime(self):
+        if not self.observed_seconds:
+            return None
+        return self.online_seconds / self.observed_seconds * 100
+
+    @property
+    def mttr(self):
+        if not self.recoveries:
+            return None
+        return timedelta(seconds=self.repair_seconds / self.recoveries)